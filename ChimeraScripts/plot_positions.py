@@ -1,40 +1,40 @@
+import os
+import sys
+
 from sets import Set
 from matplotlib import colors, cm
 
 import chimera
 from Shape.shapecmd import sphere_shape
 
+# coordinates_file lives in the parent directory of the Chimera scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from coordinates_file import loadCoordinates
+
 
 COORDINATES_FILE = ".coordinates_file.tmp"
 
 
 def plotPosition(coordinates_file):
-	with open(coordinates_file, 'r') as cf:
-		names = {}
-		points = []
-		reference = cf.readline().strip()
-		for line in cf:
-			name = line.split()[0]
-			coordinates = line.split()[1:]
-			if name not in names:
-				names[name] = len(names)
-			points.append((coordinates, names[name], name))
-
-		color_map = cm.jet
-		categories = len(names)
-		if categories == 1:
-			categories += 1
-
-		for point in points:
+	reference, data = loadCoordinates(coordinates_file)
+
+	color_map = cm.jet
+	categories = len(data)
+	if categories == 1:
+		categories += 1
+
+	for index, (name, coordinates) in enumerate(data.items()):
+		color = [i * j for i, j in zip(color_map(index * (color_map.N - 1) / (categories - 1)), [1, 1, 1, 0.3])]
+		for point in coordinates:
 			sphere_shape(radius=0.5,
 						 divisions=10,
-						 center=", ".join(point[0]),
-						 color=[i * j for i, j in zip(color_map(point[1] * (color_map.N - 1) / (categories - 1)), [1, 1, 1, 0.3])],
-						 modelId=point[1],
-						 modelName=point[2])
+						 center="{:.3f}, {:.3f}, {:.3f}".format(*point),
+						 color=color,
+						 modelId=index,
+						 modelName=name)
 
-		print "open %s" % reference
-		chimera.runCommand("open %s" % reference)
+	print "open %s" % reference
+	chimera.runCommand("open %s" % reference)
 
 
 def main():
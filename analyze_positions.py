@@ -1,12 +1,14 @@
 import argparse as ap
 import os
-import numpy as np
 from matplotlib import pyplot
+from coordinates_statistics import computeStatistics, DEFAULT_CHUNK_SIZE, DISTANCE_BIN_WIDTH
 
 
 def parseArgs():
     parser = ap.ArgumentParser()
     parser.add_argument("-i", "--input", required=True, metavar="FILE", type=str, help="path to input file")
+    parser.add_argument("-c", "--chunk", metavar="INTEGER", type=int, help="number of coordinates processed at once", default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("-b", "--bin", metavar="FLOAT", type=float, help="width of the distance bins used to estimate quantiles", default=DISTANCE_BIN_WIDTH)
     args = parser.parse_args()
 
     input_file =  os.path.abspath(args.input)
@@ -15,68 +17,44 @@ def parseArgs():
         parser.print_help()
         exit(1)
 
-    return input_file
+    return input_file, args.chunk, args.bin
 
 
-def getData(coordinates_file):
-	with open(coordinates_file, 'r') as cf:
-		data = {}
-		reference = cf.readline().strip()
-		for line in cf:
-			name = line.split()[0]
-			coordinates = line.split()[1:]
-			if name not in data:
-				data[name] = []
-			data[name].append(coordinates)
+def analyzeData(input_file, chunk_size, bin_width):
+	statistics = computeStatistics(input_file, chunk_size, bin_width)
 
-	return data
-
-
-def analyzeData(data):
-	for water in data:
+	for water, water_statistics in statistics.items():
 		print("\nWater {}".format(water))
-		x = [float(i[0]) for i in data[water]]
-		y = [float(i[1]) for i in data[water]]
-		z = [float(i[2]) for i in data[water]]
-		x_mean = np.mean(x)
-		y_mean = np.mean(y)
-		z_mean = np.mean(z)
-		x_var = np.var(x)
-		y_var = np.var(y)
-		z_var = np.var(z)
-
-		dist = []
-		initial_point = list(map(float, data[water][0]))
-		for ind, point in enumerate(data[water]):
-			current_dist = np.linalg.norm([float(i) - j for i, j in zip(point, initial_point)])
-			dist.append(current_dist)
-			data[water][ind] = [x[ind], y[ind], z[ind], current_dist]
-		central_dist = np.mean(dist)
+		x_mean, y_mean, z_mean = water_statistics.mean
+		x_var, y_var, z_var = water_statistics.variance
+		initial_point = water_statistics.initial_point
+		q1, median, q3 = water_statistics.quantiles([0.25, 0.5, 0.75])
 
 		print("x:\n\t- mean     = {: 7.3f}\n\t- variance = {: 7.3f}".format(x_mean, x_var))
 		print("y:\n\t- mean     = {: 7.3f}\n\t- variance = {: 7.3f}".format(y_mean, y_var))
 		print("z:\n\t- mean     = {: 7.3f}\n\t- variance = {: 7.3f}".format(z_mean, z_var))
 		print("initial point:\n\t({: 7.3f},{: 7.3f},{: 7.3f})".format(initial_point[0], initial_point[1], initial_point[2]))
 		print("central point:\n\t({: 7.3f},{: 7.3f},{: 7.3f})".format(x_mean, y_mean, z_mean))
-		print("average distance from initial point:\n\t{: 7.3f}".format(central_dist))
+		print("average distance from initial point:\n\t{: 7.3f}".format(water_statistics.distance_mean))
+		print("distance from initial point:\n\t- variance = {: 7.3f}\n\t- minimum  = {: 7.3f}\n\t- q1       = {: 7.3f}\n\t- median   = {: 7.3f}\n\t- q3       = {: 7.3f}\n\t- maximum  = {: 7.3f}".format(
+			water_statistics.distance_variance, water_statistics.distance_min, q1, median, q3, water_statistics.distance_max))
 
-	return data
+	return statistics
 
 
-def plotData(data):
+def plotData(statistics):
 	fig, ax = pyplot.subplots()
-	pyplot.boxplot([[i[3] for i in data[j]] for j in data], labels=[i for i in data], whis=1000)
+	ax.bxp([water_statistics.boxPlotStats() for water_statistics in statistics.values()], showfliers=False)
 	ax.set_xlabel('Explicit water')
 	ax.set_ylabel('Distance from initial point ($\AA$)')
 	pyplot.show()
 
 
 def main():
-	input_file = parseArgs()
-	data = getData(input_file)
-	data = analyzeData(data)
-	plotData(data)
+	input_file, chunk_size, bin_width = parseArgs()
+	statistics = analyzeData(input_file, chunk_size, bin_width)
+	plotData(statistics)
 
 
 if __name__ == "__main__":
-	main()
\ No newline at end of file
+	main()
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+
+import json
+import struct
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+
+BINARY_MAGIC = b"WATRTRK1"
+BINARY_EXTENSION = ".wtrk"
+TEXT_EXTENSION = ".out"
+DATA_ALIGNMENT = 64
+COORDINATES_DTYPE = np.dtype('<f4')
+COMPRESSION_METHODS = ("none", "zlib")
+
+
+def isBinaryCoordinatesFile(coordinates_file):
+    with open(coordinates_file, 'rb') as cf:
+        return cf.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+
+
+def _alignOffset(offset):
+    return (offset + DATA_ALIGNMENT - 1) // DATA_ALIGNMENT * DATA_ALIGNMENT
+
+
+# Binary layout: magic, little-endian uint32 header length, JSON header and
+# one (N, 3) float32 block per water starting at an aligned offset, so that
+# uncompressed files can be memory-mapped
+def saveBinaryCoordinates(filename_path, data, reference, compression="none"):
+    if compression not in COMPRESSION_METHODS:
+        raise ValueError("Unknown compression method: {}".format(compression))
+
+    blocks = []
+    for water, coordinates in data.items():
+        array = np.ascontiguousarray(np.asarray(coordinates, dtype=COORDINATES_DTYPE).reshape(-1, 3))
+        block = array.tobytes()
+        if compression == "zlib":
+            block = zlib.compress(block)
+        blocks.append((water, len(array), block))
+
+    # Header size depends on the offsets it contains, so iterate until stable
+    header_length = 0
+    while True:
+        offset = _alignOffset(len(BINARY_MAGIC) + 4 + header_length)
+        waters = []
+        for water, points, block in blocks:
+            waters.append({"name": water, "points": points, "offset": offset, "size": len(block)})
+            offset = _alignOffset(offset + len(block))
+        header = json.dumps({"reference": reference,
+                             "compression": compression,
+                             "waters": waters}).encode('utf-8')
+        if len(header) == header_length:
+            break
+        header_length = len(header)
+
+    with open(filename_path, 'wb') as binary_file:
+        binary_file.write(BINARY_MAGIC)
+        binary_file.write(struct.pack('<I', len(header)))
+        binary_file.write(header)
+        for water_info, (water, points, block) in zip(waters, blocks):
+            binary_file.write(b"\0" * (water_info["offset"] - binary_file.tell()))
+            binary_file.write(block)
+
+    return filename_path
+
+
+def saveTextCoordinates(filename_path, data, reference):
+    with open(filename_path, 'w') as text_file:
+        text_file.write(reference + '\n')
+        for water, coordinates in data.items():
+            for point in coordinates:
+                text_file.write("{} {: 7.3f} {: 7.3f} {: 7.3f}\n".format(water, float(point[0]), float(point[1]), float(point[2])))
+
+    return filename_path
+
+
+def readBinaryHeader(coordinates_file):
+    with open(coordinates_file, 'rb') as cf:
+        if cf.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+            raise IOError("Not a binary coordinates file: {}".format(coordinates_file))
+        header_length = struct.unpack('<I', cf.read(4))[0]
+        return json.loads(cf.read(header_length).decode('utf-8'))
+
+
+def loadBinaryCoordinates(coordinates_file, mmap=True):
+    header = readBinaryHeader(coordinates_file)
+    data = OrderedDict()
+
+    with open(coordinates_file, 'rb') as cf:
+        for water_info in header["waters"]:
+            shape = (water_info["points"], 3)
+            if water_info["points"] == 0:
+                data[water_info["name"]] = np.empty(shape, dtype=COORDINATES_DTYPE)
+            elif header["compression"] == "zlib":
+                cf.seek(water_info["offset"])
+                block = zlib.decompress(cf.read(water_info["size"]))
+                data[water_info["name"]] = np.frombuffer(block, dtype=COORDINATES_DTYPE).reshape(shape)
+            elif mmap:
+                data[water_info["name"]] = np.memmap(coordinates_file, dtype=COORDINATES_DTYPE, mode='r',
+                                                     offset=water_info["offset"], shape=shape)
+            else:
+                cf.seek(water_info["offset"])
+                data[water_info["name"]] = np.fromfile(cf, dtype=COORDINATES_DTYPE,
+                                                       count=shape[0] * 3).reshape(shape)
+
+    return header["reference"], data
+
+
+def loadTextCoordinates(coordinates_file):
+    with open(coordinates_file, 'r') as cf:
+        data = OrderedDict()
+        reference = cf.readline().strip()
+        for line in cf:
+            fields = line.split()
+            if len(fields) != 4:
+                continue
+            data.setdefault(fields[0], []).append(fields[1:])
+
+    for water, coordinates in data.items():
+        data[water] = np.array(coordinates, dtype=COORDINATES_DTYPE)
+
+    return reference, data
+
+
+def loadCoordinates(coordinates_file, mmap=True):
+    if isBinaryCoordinatesFile(coordinates_file):
+        return loadBinaryCoordinates(coordinates_file, mmap=mmap)
+    return loadTextCoordinates(coordinates_file)
+
+
+def _iterateBinaryChunks(coordinates_file, chunk_size):
+    header = readBinaryHeader(coordinates_file)
+    row_size = 3 * COORDINATES_DTYPE.itemsize
+
+    if header["compression"] != "zlib":
+        for water_info in header["waters"]:
+            if water_info["points"] == 0:
+                continue
+            coordinates = np.memmap(coordinates_file, dtype=COORDINATES_DTYPE, mode='r',
+                                    offset=water_info["offset"], shape=(water_info["points"], 3))
+            for start in range(0, len(coordinates), chunk_size):
+                yield water_info["name"], np.array(coordinates[start:start + chunk_size])
+        return
+
+    # Compressed blocks are inflated incrementally to keep memory bounded
+    with open(coordinates_file, 'rb') as cf:
+        for water_info in header["waters"]:
+            cf.seek(water_info["offset"])
+            decompressor = zlib.decompressobj()
+            remaining = water_info["size"]
+            pending = b""
+            while remaining > 0:
+                compressed = cf.read(min(remaining, chunk_size * row_size))
+                remaining -= len(compressed)
+                pending += decompressor.decompress(compressed)
+                if remaining == 0:
+                    pending += decompressor.flush()
+                usable = len(pending) // row_size * row_size
+                if usable == 0:
+                    continue
+                rows = np.frombuffer(pending[:usable], dtype=COORDINATES_DTYPE).reshape(-1, 3)
+                pending = pending[usable:]
+                for start in range(0, len(rows), chunk_size):
+                    yield water_info["name"], rows[start:start + chunk_size]
+
+
+def _parseTextChunk(lines):
+    fields = np.array("".join(lines).split()).reshape(-1, 4)
+    names = fields[:, 0]
+    coordinates = fields[:, 1:].astype(COORDINATES_DTYPE)
+
+    # Split the chunk wherever the water name changes
+    boundaries = np.flatnonzero(names[1:] != names[:-1]) + 1
+    starts = np.concatenate(([0], boundaries))
+    ends = np.concatenate((boundaries, [len(names)]))
+    for start, end in zip(starts, ends):
+        yield names[start], coordinates[start:end]
+
+
+def _iterateTextChunks(coordinates_file, chunk_size):
+    with open(coordinates_file, 'r') as cf:
+        cf.readline()
+        lines = []
+        for line in cf:
+            if len(line.split(None, 4)) != 4:
+                continue
+            lines.append(line)
+            if len(lines) == chunk_size:
+                for chunk in _parseTextChunk(lines):
+                    yield chunk
+                lines = []
+        if len(lines) > 0:
+            for chunk in _parseTextChunk(lines):
+                yield chunk
+
+
+# Yields (water, coordinates) pairs holding at most chunk_size points each,
+# in file order, without loading the whole file in memory
+def iterateCoordinateChunks(coordinates_file, chunk_size=1000000):
+    if isBinaryCoordinatesFile(coordinates_file):
+        return _iterateBinaryChunks(coordinates_file, chunk_size)
+    return _iterateTextChunks(coordinates_file, chunk_size)
+
+
+def getReference(coordinates_file):
+    if isBinaryCoordinatesFile(coordinates_file):
+        return readBinaryHeader(coordinates_file)["reference"]
+    with open(coordinates_file, 'r') as cf:
+        return cf.readline().strip()
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+
+import numpy as np
+
+from coordinates_file import iterateCoordinateChunks
+
+
+DISTANCE_BIN_WIDTH = 0.01
+DEFAULT_CHUNK_SIZE = 1000000
+
+
+def mergeMoments(count_a, mean_a, m2_a, count_b, mean_b, m2_b):
+    # Chan et al. pairwise update of Welford's running mean and squared deviations
+    count = count_a + count_b
+    if count == 0:
+        return count, mean_a, m2_a
+    delta = mean_b - mean_a
+    mean = mean_a + delta * (float(count_b) / count)
+    m2 = m2_a + m2_b + delta ** 2 * (float(count_a) * count_b / count)
+    return count, mean, m2
+
+
+class WaterStatistics(object):
+    def __init__(self, name, bin_width=DISTANCE_BIN_WIDTH):
+        self.name = name
+        self.bin_width = bin_width
+        self.count = 0
+        self.mean = np.zeros(3)
+        self.m2 = np.zeros(3)
+        self.initial_point = None
+        self.distance_mean = 0.
+        self.distance_m2 = 0.
+        self.distance_min = np.inf
+        self.distance_max = -np.inf
+        self.histogram = np.zeros(0, dtype=np.int64)
+
+    @property
+    def variance(self):
+        if self.count == 0:
+            return np.full(3, np.nan)
+        return self.m2 / self.count
+
+    @property
+    def distance_variance(self):
+        if self.count == 0:
+            return np.nan
+        return self.distance_m2 / self.count
+
+    def update(self, coordinates):
+        coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 3)
+        if len(coordinates) == 0:
+            return
+        if self.initial_point is None:
+            self.initial_point = coordinates[0].copy()
+
+        chunk_mean = coordinates.mean(axis=0)
+        chunk_m2 = ((coordinates - chunk_mean) ** 2).sum(axis=0)
+        distances = np.sqrt(((coordinates - self.initial_point) ** 2).sum(axis=1))
+        distance_mean = distances.mean()
+        distance_m2 = ((distances - distance_mean) ** 2).sum()
+
+        _, self.mean, self.m2 = mergeMoments(self.count, self.mean, self.m2,
+                                             len(coordinates), chunk_mean, chunk_m2)
+        self.count, self.distance_mean, self.distance_m2 = mergeMoments(self.count, self.distance_mean, self.distance_m2,
+                                                                        len(distances), distance_mean, distance_m2)
+        self.distance_min = min(self.distance_min, distances.min())
+        self.distance_max = max(self.distance_max, distances.max())
+        self._addToHistogram(np.bincount((distances / self.bin_width).astype(np.int64)))
+
+    def _addToHistogram(self, counts):
+        if len(counts) > len(self.histogram):
+            self.histogram = np.concatenate((self.histogram,
+                                             np.zeros(len(counts) - len(self.histogram), dtype=np.int64)))
+        self.histogram[:len(counts)] += counts
+
+    # Combines the statistics of a later segment of the same water track.
+    # Distances of the other segment must be measured from the same initial
+    # point, which is the case when both share the track's first coordinate.
+    def merge(self, other):
+        if other.count == 0:
+            return self
+        if self.initial_point is None:
+            self.initial_point = other.initial_point
+        _, self.mean, self.m2 = mergeMoments(self.count, self.mean, self.m2,
+                                             other.count, other.mean, other.m2)
+        self.count, self.distance_mean, self.distance_m2 = mergeMoments(self.count, self.distance_mean, self.distance_m2,
+                                                                        other.count, other.distance_mean, other.distance_m2)
+        self.distance_min = min(self.distance_min, other.distance_min)
+        self.distance_max = max(self.distance_max, other.distance_max)
+        self._addToHistogram(other.histogram)
+        return self
+
+    # Quantiles of the distance from the initial point, interpolated within
+    # histogram bins, so they are accurate up to bin_width
+    def quantiles(self, q):
+        q = np.atleast_1d(np.asarray(q, dtype=np.float64))
+        if self.count == 0:
+            return np.full(len(q), np.nan)
+        cumulative = np.cumsum(self.histogram)
+        targets = q * self.count
+        bins = np.minimum(np.searchsorted(cumulative, targets, side='left'), len(cumulative) - 1)
+        previous = np.where(bins > 0, cumulative[bins - 1], 0)
+        in_bin = np.maximum(self.histogram[bins], 1)
+        values = (bins + np.clip((targets - previous) / in_bin, 0., 1.)) * self.bin_width
+        return np.clip(values, self.distance_min, self.distance_max)
+
+    def boxPlotStats(self):
+        q1, median, q3 = self.quantiles([0.25, 0.5, 0.75])
+        return {"label": self.name,
+                "med": median,
+                "q1": q1,
+                "q3": q3,
+                "whislo": self.distance_min,
+                "whishi": self.distance_max,
+                "mean": self.distance_mean,
+                "fliers": []}
+
+
+def computeStatistics(coordinates_file, chunk_size=DEFAULT_CHUNK_SIZE, bin_width=DISTANCE_BIN_WIDTH):
+    statistics = OrderedDict()
+
+    for water, coordinates in iterateCoordinateChunks(coordinates_file, chunk_size):
+        if water not in statistics:
+            statistics[water] = WaterStatistics(water, bin_width)
+        statistics[water].update(coordinates)
+
+    return statistics
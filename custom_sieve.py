@@ -3,7 +3,9 @@
 import pandas as pd
 import argparse as ap
 import os
-import glob
+
+from pele_manifest import buildManifest, findFiles
+from water_database import connectDatabase
 
 
 ACCEPTED_STEPS_COL = 'numberOfAcceptedPeleSteps'
@@ -25,15 +27,16 @@ def parseArgs():
     parser.add_argument("-o", metavar="PATH", type=str, help="Output path", default=working_dir)
     parser.add_argument("-d", metavar="FLOAT", type=float, help="Maximum accepted water distance", default=MAXIMUM_ACCEPTED_WATER_DISTANCE)
     parser.add_argument("-s", metavar="INT", type=int, help="Filter the results by an initial structure", default=None)
+    parser.add_argument("-db", metavar="PATH", type=str, help="Read the reports from a database built with water_database.py", default=None)
     args = parser.parse_args()
 
     in_path =  os.path.abspath(args.i)
     out_path =  os.path.abspath(args.o)
-    return in_path, out_path, args.d, args.s
+    return in_path, out_path, args.d, args.s, args.db
 
 
 def getAllPeleReports(path):
-    reports = glob.glob(os.path.join(path, "*report*"))
+    reports = findFiles(buildManifest([path], max_depth=0), "*report*")
     if (len(reports) == 0):
         raise NameError('No Pele reports found in the input path') 
     return reports
@@ -72,6 +75,41 @@ def getWaterMediatedStructures(parsed_reports, accepted_wat_dist):
     return selected_steps
 
 
+def getDatabaseWaterMediatedStructures(database, path, accepted_wat_dist):
+    connection = connectDatabase(database)
+    selected_steps = pd.read_sql_query(
+        'SELECT m.trajectory AS "{}", CAST(m.accepted_steps AS INTEGER) AS "{}", m.distance AS "{}", m.rmsd AS "{}", '
+        'm.binding_energy AS "{}", m.current_energy AS "{}", m.model '
+        'FROM trajectories t JOIN models m ON m.trajectory_id = t.id '
+        'WHERE t.directory = ? AND m.distance < ? ORDER BY m.trajectory, m.model'.format(
+            TRAJECTORY_NUM_COL, ACCEPTED_STEPS_COL, WATER_DISTANCE_COL, RMSD_DEVIATION_COL,
+            BINDING_ENERGY_COL, CURRENT_ENERGY_COL),
+        connection, params=(path, accepted_wat_dist))
+    initial_steps = pd.read_sql_query(
+        'SELECT m.trajectory AS "{}", m.current_energy AS initial_energy, m.model '
+        'FROM trajectories t JOIN models m ON m.trajectory_id = t.id '
+        'WHERE t.directory = ? AND m.accepted_steps = 0 ORDER BY m.trajectory, m.model'.format(TRAJECTORY_NUM_COL),
+        connection, params=(path, ))
+    connection.close()
+
+    if len(selected_steps) == 0:
+        raise NameError('No Pele reports found in the database for the input path')
+
+    # Each step belongs to the initial structure of the closest preceding
+    # step without accepted steps, as in linkTrajectoriesWithSameStartingPoint
+    initial_structures = {}
+    for initial_energy in initial_steps['initial_energy']:
+        if initial_energy not in initial_structures:
+            initial_structures[initial_energy] = len(initial_structures) + 1
+    initial_steps[INITIAL_STRUCT_COL] = initial_steps['initial_energy'].map(initial_structures)
+
+    selected_steps = pd.merge_asof(selected_steps.sort_values('model'),
+                                   initial_steps.sort_values('model').loc[:, [TRAJECTORY_NUM_COL, 'model', INITIAL_STRUCT_COL]],
+                                   on='model', by=TRAJECTORY_NUM_COL, direction='backward')
+
+    return selected_steps.drop(columns=['model'])
+
+
 def sortReportsBy(parsed_reports, column, criteria='min'):
     if criteria is 'min':
         results = parsed_reports.sort_values(by=[column])
@@ -105,15 +143,20 @@ def renameDataFrame(parsed_reports):
     return results
 
 
-def main(in_path, out_path, accepted_wat_dist, initial_struct):
-    pele_reports = getAllPeleReports(in_path)
+def main(in_path, out_path, accepted_wat_dist, initial_struct, database=None):
+    if database is not None:
+        best_reports = getDatabaseWaterMediatedStructures(database, in_path, accepted_wat_dist)
+
+    else:
+        pele_reports = getAllPeleReports(in_path)
+
+        parsed_reports = {}
+        for report in pele_reports:
+            report_id = os.path.basename(report).split("_")[-1]
+            parsed_reports[report_id] = parsePeleReport(report, report_id)
 
-    parsed_reports = {}
-    for report in pele_reports:
-        report_id = os.path.basename(report).split("_")[-1]
-        parsed_reports[report_id] = parsePeleReport(report, report_id)
+        best_reports = getWaterMediatedStructures(parsed_reports, accepted_wat_dist)
 
-    best_reports = getWaterMediatedStructures(parsed_reports, accepted_wat_dist)
     sorted_reports = sortReportsBy(best_reports, BINDING_ENERGY_COL)
     filtered_by_rms_reports = filterReportsByRMSD(sorted_reports)
 
@@ -129,5 +172,5 @@ def main(in_path, out_path, accepted_wat_dist, initial_struct):
     
 
 if __name__ == "__main__":
-    in_path, out_path, accepted_wat_dist, initial_struct = parseArgs()
-    main(in_path, out_path, accepted_wat_dist, initial_struct)
+    in_path, out_path, accepted_wat_dist, initial_struct, database = parseArgs()
+    main(in_path, out_path, accepted_wat_dist, initial_struct, database)
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+import argparse as ap
+import os
+import glob
+from collections import OrderedDict
+
+import numpy as np
+
+from coordinates_file import saveBinaryCoordinates, saveTextCoordinates
+from scatter_rendering import MAX_MARKERS
+from shard_analysis import loadPartials, iterateTrajectories, MATCHES_PARTIAL, TRACKING_PARTIAL
+from water_radius import parseAxisData, getAxisDefaults, drawScatterPlot
+from water_tracking import saveCoordinatesFile
+
+
+def parsePartials(partials_to_parse, parser):
+    partials = []
+
+    for partial_list in partials_to_parse:
+        partials_found = sorted(glob.glob(partial_list))
+        if len(partials_found) == 0:
+            print "Warning: partial result path \'", partial_list, "\' not found."
+        partials += partials_found
+
+    if len(partials) == 0:
+        print "Error: list of partial results is empty."
+        parser.print_help()
+        exit(1)
+
+    return partials
+
+
+def parseArgs():
+    parser = ap.ArgumentParser()
+    optional = parser._action_groups.pop()
+    required = parser.add_argument_group('required arguments')
+    required.add_argument("-i", "--input", required=True, metavar="FILE", type=str, nargs='*', help="path to partial result files")
+    optional.add_argument("-p", "--plot", action="store_true", help="plot merged water matches instead of only printing the occupancy table")
+    optional.add_argument("-X", "--xaxis", metavar="INTEGER [METRIC]", type=str, nargs='*', help="column number and metric to plot on the X axis", default=None)
+    optional.add_argument("-Y", "--yaxis", metavar="INTEGER [METRIC]", type=str, nargs='*', help="column number and metric to plot on the Y axis", default=None)
+    optional.add_argument("-M", "--markers", metavar="INTEGER", type=int, help="maximum number of visible points drawn as markers, denser views are rasterized", default=MAX_MARKERS)
+    optional.add_argument("-o", "--output", metavar="PATH", type=str, help="output path to save the figure or the merged coordinates", default=None)
+    optional.add_argument("-f", "--format", metavar="FORMAT", type=str, choices=["binary", "text"], help="format of the merged coordinates file (binary or text)", default="binary")
+    optional.add_argument("-z", "--compress", action="store_true", help="compress binary coordinates file (disables memory-mapping)")
+    parser._action_groups.append(optional)
+    args = parser.parse_args()
+
+    partial_paths = parsePartials(args.input, parser)
+
+    output_path = args.output
+    if output_path is not None:
+        output_path = os.path.abspath(output_path)
+
+    return partial_paths, args.plot, args.xaxis, args.yaxis, args.markers, output_path, args.format, args.compress
+
+
+def getOccupancyTable(partials):
+    occupancy = np.zeros(0, dtype=np.int64)
+
+    for trajectory, arrays, segment in iterateTrajectories(partials):
+        offsets = arrays["match_offsets"]
+        counts = np.bincount(arrays["matches"][offsets[segment]:offsets[segment + 1]])
+        if len(counts) > len(occupancy):
+            occupancy = np.concatenate((occupancy, np.zeros(len(counts) - len(occupancy), dtype=np.int64)))
+        occupancy[:len(counts)] += counts
+
+    return occupancy
+
+
+def printOccupancyTable(occupancy):
+    total = max(occupancy.sum(), 1)
+    print "{:>8} {:>12} {:>10}".format("Matches", "Models", "Fraction")
+    for matches, models in enumerate(occupancy):
+        print "{:>8d} {:>12d} {:>10.4f}".format(matches, models, models / float(total))
+    print "{:>8} {:>12d}".format("Total", occupancy.sum())
+
+
+def getPartialPlotData(partials, x_rows, y_rows):
+    x_values = []
+    y_values = []
+    labels = []
+    point_trajectories = []
+    point_models = []
+    trajectories_info = []
+
+    x_columns = np.array(x_rows) - 1
+    y_columns = np.array(y_rows) - 1
+
+    for trajectory, arrays, segment in iterateTrajectories(partials):
+        match_offsets = arrays["match_offsets"]
+        report_offsets = arrays["report_offsets"]
+        matches = arrays["matches"][match_offsets[segment]:match_offsets[segment + 1]]
+        report = arrays["reports"][report_offsets[segment]:report_offsets[segment + 1]]
+
+        num_models = min(len(matches), len(report))
+        x_total = report[:num_models, x_columns].sum(axis=1)
+        y_total = report[:num_models, y_columns].sum(axis=1)
+        valid = np.flatnonzero(~np.isnan(x_total) & ~np.isnan(y_total))
+
+        x_values.append(x_total[valid])
+        y_values.append(y_total[valid])
+        labels.append(matches[valid])
+        point_trajectories.append(np.full(len(valid), len(trajectories_info), dtype=np.int64))
+        point_models.append(valid + 1)
+        trajectories_info.append((trajectory["epoch"], trajectory["number"]))
+
+    def join(arrays, dtype):
+        if len(arrays) == 0:
+            return np.empty(0, dtype=dtype)
+        return np.concatenate(arrays).astype(dtype)
+
+    return (join(x_values, np.float64), join(y_values, np.float64), join(labels, np.int64),
+            join(point_trajectories, np.int64), join(point_models, np.int64), trajectories_info)
+
+
+def mergeTracking(partials, water_names):
+    segments = OrderedDict((water, []) for water in water_names)
+
+    for trajectory, arrays, segment in iterateTrajectories(partials):
+        offsets = arrays["offsets"]
+        for water_index, water in enumerate(water_names):
+            position = segment * len(water_names) + water_index
+            segments[water].append(arrays["coordinates"][offsets[position]:offsets[position + 1]])
+
+    data = OrderedDict()
+    for water, water_segments in segments.items():
+        if len(water_segments) > 0:
+            data[water] = np.concatenate(water_segments)
+        else:
+            data[water] = np.empty((0, 3), dtype=np.float32)
+
+    return data
+
+
+def main():
+    partial_paths, plot, x_data, y_data, max_markers, output_path, file_format, compress = parseArgs()
+
+    print " - Loading {} partial results...".format(len(partial_paths))
+    try:
+        kind, settings, partials = loadPartials(partial_paths)
+    except IOError as error:
+        print "Error:", error
+        exit(1)
+
+    if kind == MATCHES_PARTIAL:
+        printOccupancyTable(getOccupancyTable(partials))
+        if not plot:
+            return
+
+        x_rows, x_name = parseAxisData(x_data)
+        y_rows, y_name = parseAxisData(y_data)
+        x_rows, y_rows, x_name, y_name = getAxisDefaults(x_rows, y_rows, x_name, y_name)
+
+        x_values, y_values, labels, point_trajectories, point_models, trajectories_info = getPartialPlotData(partials, x_rows, y_rows)
+
+        def annotate(ind):
+            epoch, traj_number = trajectories_info[point_trajectories[ind]]
+            return "Epoch: " + epoch + "\n" + "Trajectory: " + traj_number + "\n" + "Model: " + str(point_models[ind])
+
+        print " - Plotting..."
+        drawScatterPlot(x_values, y_values, labels, annotate, x_name, y_name, output_path=output_path, max_markers=max_markers)
+
+    elif kind == TRACKING_PARTIAL:
+        data = mergeTracking(partials, settings["waters"])
+        reference = settings["reference"]
+
+        print " - Saving coordinates..."
+        if output_path is None:
+            filename_path = saveCoordinatesFile(data, reference, file_format, compress)
+        elif file_format == "text":
+            filename_path = saveTextCoordinates(output_path, data, reference)
+        else:
+            filename_path = saveBinaryCoordinates(output_path, data, reference,
+                                                  compression="zlib" if compress else "none")
+        print "Coordinates saved at:", filename_path
+
+    else:
+        print "Error: unknown partial result kind \'", kind, "\'."
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+
+import argparse as ap
+import os
+
+import numpy as np
+from matplotlib import pyplot
+
+from water_database import connectDatabase, DATABASE_NAME
+
+
+RESAMPLES = 1000
+CONFIDENCE = 0.95
+BLOCK_SIZE = 100
+MAX_WEIGHTS_PER_BATCH = 2 ** 22
+
+
+def loadOccupancy(connection):
+    # Returns a (models, sites) boolean matrix with its models sorted by
+    # epoch, together with the epoch and trajectory of every model
+    sites = [row[0] for row in connection.execute("SELECT water FROM sites ORDER BY site")]
+    models = np.array(connection.execute("SELECT trajectory_id, model, epoch FROM models "
+                                         "WHERE sites_filled IS NOT NULL "
+                                         "ORDER BY epoch, trajectory_id, model").fetchall(), dtype=np.int64).reshape(-1, 3)
+    filled = np.array(connection.execute("SELECT trajectory_id, model, site FROM occupancy").fetchall(),
+                      dtype=np.int64).reshape(-1, 3)
+
+    occupancy = np.zeros((len(models), len(sites)), dtype=bool)
+    if len(models) > 0 and len(filled) > 0:
+        stride = max(models[:, 1].max(), filled[:, 1].max()) + 1
+        keys = models[:, 0] * stride + models[:, 1]
+        order = np.argsort(keys)
+        filled_keys = filled[:, 0] * stride + filled[:, 1]
+        positions = np.clip(np.searchsorted(keys[order], filled_keys), 0, len(keys) - 1)
+        found = keys[order][positions] == filled_keys
+        occupancy[order[positions[found]], filled[found, 2]] = True
+
+    return sites, occupancy, models[:, 2], models[:, 0]
+
+
+def getEpochBoundaries(epochs):
+    # Epochs must be sorted. Returns the epochs and the index after their
+    # last model.
+    unique_epochs, starts = np.unique(epochs, return_index=True)
+    ends = np.append(starts[1:], len(epochs))
+    return unique_epochs, ends
+
+
+def cumulativeOccupancy(occupancy, epochs):
+    unique_epochs, ends = getEpochBoundaries(epochs)
+    cumulative = np.cumsum(occupancy, axis=0, dtype=np.int64)[ends - 1]
+    return unique_epochs, ends, cumulative / ends[:, None].astype(np.float64)
+
+
+def getBlocks(epochs, block_size=BLOCK_SIZE, trajectories=None):
+    # Consecutive models of the same epoch (and trajectory) are grouped in
+    # blocks of at most block_size models, so that every epoch prefix is a
+    # whole number of blocks
+    num_models = len(epochs)
+    if num_models == 0:
+        return np.empty(0, dtype=np.int64)
+
+    group_starts = np.zeros(num_models, dtype=bool)
+    group_starts[0] = True
+    group_starts[1:] = epochs[1:] != epochs[:-1]
+    if trajectories is not None:
+        group_starts[1:] |= trajectories[1:] != trajectories[:-1]
+
+    group_ids = np.cumsum(group_starts) - 1
+    group_first = np.flatnonzero(group_starts)[group_ids]
+    block_starts = group_starts | ((np.arange(num_models) - group_first) % block_size == 0)
+
+    return np.cumsum(block_starts) - 1
+
+
+def getBlockSums(occupancy, blocks):
+    starts = np.flatnonzero(np.diff(blocks, prepend=-1))
+    block_sums = np.add.reduceat(occupancy.astype(np.int64), starts, axis=0).astype(np.float64)
+    block_sizes = np.diff(np.append(starts, len(blocks))).astype(np.float64)
+    return block_sums, block_sizes
+
+
+def bootstrapOccupancy(occupancy, epochs, blocks, resamples=RESAMPLES, confidence=CONFIDENCE, seed=None):
+    # Block bootstrap of the cumulative occupancy at every epoch. Blocks are
+    # resampled within their own epoch, so a single draw of block weights
+    # gives the resamples of every epoch prefix through cumulative sums.
+    # Resamples are drawn in batches as block weight matrices, so the cost
+    # depends on the number of blocks rather than on the number of models.
+    random_state = np.random.RandomState(seed)
+    unique_epochs, ends = getEpochBoundaries(epochs)
+    block_sums, block_sizes = getBlockSums(occupancy, blocks)
+    num_blocks = len(block_sizes)
+
+    epoch_ends = blocks[ends - 1] + 1
+    epoch_starts = np.append(0, epoch_ends[:-1])
+    block_epochs = np.repeat(np.arange(len(unique_epochs)), epoch_ends - epoch_starts)
+    first_blocks = epoch_starts[block_epochs]
+    epoch_lengths = (epoch_ends - epoch_starts)[block_epochs]
+
+    batch = max(1, min(resamples, MAX_WEIGHTS_PER_BATCH // num_blocks))
+    estimates = []
+    for start in range(0, resamples, batch):
+        size = min(batch, resamples - start)
+        # Each row counts how many times every block was drawn
+        draws = first_blocks + (random_state.random_sample((size, num_blocks)) * epoch_lengths).astype(np.int64)
+        draws += np.arange(size)[:, None] * num_blocks
+        weights = np.bincount(draws.ravel(), minlength=size * num_blocks).reshape(size, num_blocks).astype(np.float64)
+        sums = np.cumsum([weights[:, first:last].dot(block_sums[first:last])
+                          for first, last in zip(epoch_starts, epoch_ends)], axis=0)
+        sizes = np.cumsum([weights[:, first:last].dot(block_sizes[first:last])
+                           for first, last in zip(epoch_starts, epoch_ends)], axis=0)
+        estimates.append(sums / sizes[:, :, None])
+    estimates = np.concatenate(estimates, axis=1)
+
+    alpha = (1. - confidence) / 2.
+    lower, upper = np.percentile(estimates, [100. * alpha, 100. * (1. - alpha)], axis=1)
+
+    return unique_epochs, lower, upper
+
+
+def blockStandardErrors(occupancy, blocks):
+    # Standard error of the mean occupancy from the spread of block means
+    block_sums, block_sizes = getBlockSums(occupancy, blocks)
+    block_means = block_sums / block_sizes[:, None]
+
+    if len(block_means) < 2:
+        return np.full(occupancy.shape[1], np.nan)
+
+    return block_means.std(axis=0, ddof=1) / np.sqrt(len(block_means))
+
+
+def plotConvergence(sites, x_values, x_name, occupancy, lower, upper, output_path=None):
+    fig, ax = pyplot.subplots()
+    for site, water in enumerate(sites):
+        line, = ax.plot(x_values, occupancy[:, site], label=water)
+        ax.fill_between(x_values, lower[:, site], upper[:, site], color=line.get_color(), alpha=0.3)
+
+    ax.set_xlabel(x_name)
+    ax.set_ylabel('Cumulative site occupancy')
+    ax.set_ylim(0, 1)
+    ax.legend()
+
+    if output_path is not None:
+        pyplot.savefig(output_path)
+    else:
+        pyplot.show()
+
+
+def parseArgs():
+    parser = ap.ArgumentParser()
+    parser.add_argument("-db", "--database", metavar="PATH", type=str, help="path to the SQLite database", default=DATABASE_NAME)
+    parser.add_argument("-n", "--resamples", metavar="INTEGER", type=int, help="number of bootstrap resamples", default=RESAMPLES)
+    parser.add_argument("-c", "--confidence", metavar="FLOAT", type=float, help="confidence level of the intervals", default=CONFIDENCE)
+    parser.add_argument("-b", "--block", metavar="INTEGER", type=int, help="maximum number of consecutive models per block", default=BLOCK_SIZE)
+    parser.add_argument("-T", "--by-trajectory", action="store_true", help="never mix models of different trajectories in a block")
+    parser.add_argument("-x", "--xaxis", metavar="AXIS", type=str, choices=["epoch", "steps"], help="plot against epochs or accepted steps", default="epoch")
+    parser.add_argument("-t", "--tolerance", metavar="FLOAT", type=float, help="confidence interval width below which a site is considered converged", default=None)
+    parser.add_argument("-s", "--seed", metavar="INTEGER", type=int, help="random seed", default=None)
+    parser.add_argument("-p", "--plot", action="store_true", help="plot the cumulative occupancy")
+    parser.add_argument("-o", "--output", metavar="PATH", type=str, help="output path to save figure", default=None)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        print("Error: path to database \'{}\' not found.".format(args.database))
+        parser.print_help()
+        exit(1)
+
+    return args
+
+
+def main():
+    args = parseArgs()
+
+    connection = connectDatabase(args.database)
+    sites, occupancy, epochs, trajectories = loadOccupancy(connection)
+    connection.close()
+
+    if len(occupancy) == 0:
+        print("Error: the database does not contain any model")
+        exit(1)
+
+    print(" - Computing convergence of {} sites over {} models...".format(len(sites), len(occupancy)))
+    unique_epochs, ends, cumulative = cumulativeOccupancy(occupancy, epochs)
+    blocks = getBlocks(epochs, args.block, trajectories if args.by_trajectory else None)
+    unique_epochs, lower, upper = bootstrapOccupancy(occupancy, epochs, blocks, args.resamples,
+                                                     args.confidence, args.seed)
+    standard_errors = blockStandardErrors(occupancy, blocks)
+
+    print("{:>8} {:>10} ".format("Epoch", "Models") + " ".join("{:>22}".format(water) for water in sites))
+    for e, epoch in enumerate(unique_epochs):
+        print("{:>8d} {:>10d} ".format(epoch, ends[e]) +
+              " ".join("{:>8.3f} [{:.3f},{:.3f}]".format(cumulative[e, s], lower[e, s], upper[e, s])
+                       for s in range(len(sites))))
+    print("{:>19} ".format("Block std. error") + " ".join("{:>22.4f}".format(error) for error in standard_errors))
+
+    if args.tolerance is not None:
+        widths = upper[-1] - lower[-1]
+        converged = widths <= args.tolerance
+        for water, width, site_converged in zip(sites, widths, converged):
+            print("{}: interval width {:.4f} {}".format(water, width, "converged" if site_converged else "not converged"))
+        if converged.all():
+            print("All sites converged")
+
+    if args.plot or args.output is not None:
+        if args.xaxis == "steps":
+            x_values, x_name = ends, "Accepted steps"
+        else:
+            x_values, x_name = unique_epochs, "Epoch"
+        plotConvergence(sites, x_values, x_name, cumulative, lower, upper, args.output)
+
+
+if __name__ == "__main__":
+    main()
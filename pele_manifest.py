@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+import argparse as ap
+import os
+import re
+import json
+import fnmatch
+import time
+from multiprocessing.pool import ThreadPool
+
+try:
+    from os import scandir
+except ImportError:
+    # Python 2 needs the scandir backport, otherwise fall back to listdir
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+MANIFEST_NAME = ".pele_manifest.json"
+MANIFEST_VERSION = 3
+TRAJECTORY_NAME = "trajectory"
+REPORT_NAME = "run_report"
+MAX_DEPTH = 1
+PROCESSES = 8
+SETTLE_TIME = 2.
+
+
+def getManifestPath(root):
+    return os.path.join(os.path.abspath(root), MANIFEST_NAME)
+
+
+def _listDirectory(path):
+    files = {}
+    directories = []
+
+    for name in os.listdir(path):
+        entry_path = os.path.join(path, name)
+        if os.path.isdir(entry_path):
+            directories.append(name)
+        elif os.path.isfile(entry_path) and name != MANIFEST_NAME:
+            stat = os.stat(entry_path)
+            files[name] = [stat.st_size, stat.st_mtime]
+
+    return {"files": files, "directories": sorted(directories)}
+
+
+def scanDirectory(path):
+    if scandir is None:
+        return _listDirectory(path)
+
+    files = {}
+    directories = []
+
+    for entry in scandir(path):
+        if entry.is_dir():
+            directories.append(entry.name)
+        elif entry.is_file() and entry.name != MANIFEST_NAME:
+            stat = entry.stat()
+            files[entry.name] = [stat.st_size, stat.st_mtime]
+
+    return {"files": files, "directories": sorted(directories)}
+
+
+def _scanIfChanged(arguments):
+    path, cached, running = arguments
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return None
+
+    # Adding, removing or renaming files changes the directory mtime, so the
+    # cached listing is still valid if it did not change. A listing taken
+    # within SETTLE_TIME of the last change may have missed a file created
+    # in the same second (mtime resolution is coarse on Lustre and NFS), and
+    # PELE appends to the files of the running epoch in place, so both are
+    # always scanned again.
+    if (cached is not None and not running and cached["mtime"] == mtime and
+            cached["scanned"] - mtime > SETTLE_TIME):
+        return cached
+
+    scanned = time.time()
+    directory = scanDirectory(path)
+    directory["mtime"] = mtime
+    directory["scanned"] = scanned
+    return directory
+
+
+def getRunningEpoch(path, directories):
+    # The epoch with the highest number is the one PELE may still be writing
+    epochs = [name for name in directories if name.isdigit()]
+    if len(epochs) == 0:
+        return None
+    return os.path.join(path, max(epochs, key=int))
+
+
+def loadCache(cache_path):
+    try:
+        with open(cache_path, 'r') as cache_file:
+            cache = json.load(cache_file)
+    except (IOError, OSError, ValueError):
+        return {}
+
+    if cache.get("version") != MANIFEST_VERSION:
+        return {}
+    return cache["directories"]
+
+
+def saveCache(cache_path, manifest):
+    # Write and rename, so that concurrent jobs never read a partial manifest
+    temporary_path = "{}.{}.tmp".format(cache_path, os.getpid())
+    try:
+        with open(temporary_path, 'w') as cache_file:
+            json.dump({"version": MANIFEST_VERSION, "directories": manifest}, cache_file)
+        os.rename(temporary_path, cache_path)
+    except (IOError, OSError):
+        print("Warning: manifest could not be saved at \'{}\'".format(cache_path))
+
+
+# Walks the given directories down to max_depth levels, scanning every
+# level in parallel. Returns a dictionary from directory path to its files
+# (with size and mtime) and subdirectories. Cached directories are reused
+# unless they changed, or are the running epoch of their PELE output.
+def buildManifest(roots, cache_path=None, max_depth=MAX_DEPTH, processes=PROCESSES, refresh=False):
+    cached = {}
+    if cache_path is not None and not refresh:
+        cached = loadCache(cache_path)
+
+    manifest = {}
+    level = [(os.path.abspath(root), 0, False) for root in roots]
+    pool = ThreadPool(processes)
+
+    while len(level) > 0:
+        directories = pool.map(_scanIfChanged, [(path, cached.get(path), running) for path, depth, running in level])
+        next_level = []
+        for (path, depth, running), directory in zip(level, directories):
+            if directory is None:
+                continue
+            manifest[path] = directory
+            if depth < max_depth:
+                running_epoch = getRunningEpoch(path, directory["directories"])
+                next_level += [(os.path.join(path, name), depth + 1, os.path.join(path, name) == running_epoch)
+                               for name in directory["directories"]]
+        level = next_level
+
+    pool.close()
+    pool.join()
+
+    if cache_path is not None:
+        saveCache(cache_path, manifest)
+
+    return manifest
+
+
+def getEpoch(directory):
+    epoch = os.path.basename(directory)
+    if not epoch.isdigit():
+        epoch = '0'
+    return epoch
+
+
+def getTrajectoryNumber(trajectory):
+    return os.path.basename(trajectory).split('_')[-1].split('.')[0]
+
+
+# Pairs every trajectory_N.pdb with the run_report_N of its directory
+def pairTrajectories(manifest, trajectory_name=TRAJECTORY_NAME, report_name=REPORT_NAME):
+    trajectory_pattern = re.compile(r"^" + re.escape(trajectory_name) + r"_(\d+)\.pdb$")
+    pairs = []
+
+    for path, directory in manifest.items():
+        files = directory["files"]
+        for name, (size, mtime) in files.items():
+            match = trajectory_pattern.match(name)
+            if match is None:
+                continue
+            number = match.group(1)
+            report = report_name + "_" + number
+            report_size, report_mtime = files.get(report, (None, None))
+            pairs.append({"trajectory": os.path.join(path, name),
+                          "report": os.path.join(path, report) if report in files else None,
+                          "directory": path,
+                          "epoch": getEpoch(path),
+                          "number": number,
+                          "size": size,
+                          "mtime": mtime,
+                          "report_size": report_size,
+                          "report_mtime": report_mtime})
+
+    pairs.sort(key=lambda pair: (pair["directory"], int(pair["number"])))
+
+    return pairs
+
+
+def findFiles(manifest, pattern):
+    return sorted(os.path.join(path, name) for path, directory in manifest.items()
+                  for name in directory["files"] if fnmatch.fnmatch(name, pattern))
+
+
+def findTrajectories(root, trajectory_name=TRAJECTORY_NAME, report_name=REPORT_NAME, refresh=False):
+    manifest = buildManifest([root], getManifestPath(root), refresh=refresh)
+    return pairTrajectories(manifest, trajectory_name, report_name)
+
+
+def parseArgs():
+    parser = ap.ArgumentParser()
+    parser.add_argument("-i", "--input", required=True, metavar="PATH", type=str, nargs='*', help="path to PELE output directories")
+    parser.add_argument("-t", "--trajectory", metavar="NAME", type=str, help="Trajectory file name", default=TRAJECTORY_NAME)
+    parser.add_argument("-rp", "--report", metavar="NAME", type=str, help="Report file name", default=REPORT_NAME)
+    parser.add_argument("-d", "--depth", metavar="INTEGER", type=int, help="maximum directory depth to scan", default=MAX_DEPTH)
+    parser.add_argument("-j", "--processes", metavar="INTEGER", type=int, help="number of directories scanned in parallel", default=PROCESSES)
+    parser.add_argument("-f", "--refresh", action="store_true", help="ignore the cached manifest and re-stat every file")
+    args = parser.parse_args()
+
+    return args
+
+
+def main():
+    args = parseArgs()
+
+    for root in args.input:
+        if not os.path.isdir(root):
+            print("Warning: PELE output directory \'{}\' not found.".format(root))
+            continue
+        manifest = buildManifest([root], getManifestPath(root), args.depth, args.processes, args.refresh)
+        pairs = pairTrajectories(manifest, args.trajectory, args.report)
+        unpaired = len([pair for pair in pairs if pair["report"] is None])
+        epochs = len(set(pair["epoch"] for pair in pairs))
+        print("{}: {} trajectories in {} epochs, {} without report".format(root, len(pairs), epochs, unpaired))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+
+MAX_MARKERS = 100000
+PIXELS_PER_BIN = 3
+HOVER_TOLERANCE = 5.
+MAX_INDEX_CELLS_PER_AXIS = 1024
+POINTS_PER_INDEX_CELL = 4
+
+
+class PointIndex(object):
+    # Uniform grid over the data bounding box. Points are sorted by cell so
+    # that each grid column is a contiguous slice of the sorted arrays.
+    def __init__(self, x_values, y_values):
+        self.x_values = np.asarray(x_values, dtype=np.float64)
+        self.y_values = np.asarray(y_values, dtype=np.float64)
+        num_points = len(self.x_values)
+
+        cells = int(np.sqrt(max(num_points, 1) / float(POINTS_PER_INDEX_CELL)))
+        self.cells = min(max(cells, 1), MAX_INDEX_CELLS_PER_AXIS)
+
+        if num_points > 0:
+            self.x_min, self.x_max = self.x_values.min(), self.x_values.max()
+            self.y_min, self.y_max = self.y_values.min(), self.y_values.max()
+        else:
+            self.x_min = self.x_max = self.y_min = self.y_max = 0.
+        self.x_width = max(self.x_max - self.x_min, 1e-12) / self.cells
+        self.y_width = max(self.y_max - self.y_min, 1e-12) / self.cells
+
+        cell_ids = self._cellX(self.x_values) * self.cells + self._cellY(self.y_values)
+        self.order = np.argsort(cell_ids, kind='mergesort')
+        self.starts = np.searchsorted(cell_ids[self.order], np.arange(self.cells * self.cells + 1))
+
+    def _cellX(self, x):
+        return np.clip(((np.asarray(x) - self.x_min) / self.x_width).astype(np.int64), 0, self.cells - 1)
+
+    def _cellY(self, y):
+        return np.clip(((np.asarray(y) - self.y_min) / self.y_width).astype(np.int64), 0, self.cells - 1)
+
+    # Returns the index of the nearest point inside the ellipse of semi-axes
+    # x_tolerance and y_tolerance around (x, y), or None
+    def nearest(self, x, y, x_tolerance, y_tolerance):
+        if (len(self.order) == 0 or x + x_tolerance < self.x_min or x - x_tolerance > self.x_max or
+                y + y_tolerance < self.y_min or y - y_tolerance > self.y_max):
+            return None
+
+        first_x, last_x = self._cellX([x - x_tolerance, x + x_tolerance])
+        first_y, last_y = self._cellY([y - y_tolerance, y + y_tolerance])
+        candidates = [self.order[self.starts[i * self.cells + first_y]:self.starts[i * self.cells + last_y + 1]]
+                      for i in range(first_x, last_x + 1)]
+        candidates = np.concatenate(candidates)
+        if len(candidates) == 0:
+            return None
+
+        distances = (((self.x_values[candidates] - x) / x_tolerance) ** 2 +
+                     ((self.y_values[candidates] - y) / y_tolerance) ** 2)
+        closest = np.argmin(distances)
+        if distances[closest] > 1.:
+            return None
+        return int(candidates[closest])
+
+
+def rasterizeCategories(x_values, y_values, labels, colors, extent, shape):
+    # Blends the colour of each category weighted by its number of points in
+    # every bin, and sets the opacity from the logarithm of the bin density
+    x_min, x_max, y_min, y_max = extent
+    rows, columns = shape
+    num_categories = len(colors)
+
+    x_bins = ((x_values - x_min) / (x_max - x_min) * columns).astype(np.int64)
+    y_bins = ((y_values - y_min) / (y_max - y_min) * rows).astype(np.int64)
+    inside = (x_bins >= 0) & (x_bins < columns) & (y_bins >= 0) & (y_bins < rows)
+    bins = y_bins[inside] * columns + x_bins[inside]
+
+    counts = np.bincount(labels[inside] * (rows * columns) + bins,
+                         minlength=num_categories * rows * columns).reshape(num_categories, rows * columns)
+    totals = counts.sum(axis=0)
+
+    image = np.zeros((rows * columns, 4))
+    occupied = totals > 0
+    image[occupied, :3] = counts[:, occupied].T.dot(np.asarray(colors)[:, :3]) / totals[occupied, None]
+    image[occupied, 3] = 0.2 + 0.8 * np.log1p(totals[occupied]) / np.log1p(totals.max())
+
+    return image.reshape(rows, columns, 4)
+
+
+class DensityScatter(object):
+    # Draws the points as markers while at most max_markers are visible and
+    # as a per-category density image otherwise, re-binning on zoom and pan
+    def __init__(self, ax, x_values, y_values, labels, cmap, norm, s=None, alpha=0.6, max_markers=MAX_MARKERS):
+        self.ax = ax
+        self.x_values = np.asarray(x_values, dtype=np.float64)
+        self.y_values = np.asarray(y_values, dtype=np.float64)
+        self.labels = np.asarray(labels, dtype=np.int64)
+        self.max_markers = max_markers
+        self.colors = cmap(norm(np.arange(self.labels.max() + 1 if len(self.labels) > 0 else 1)))
+        self.index = PointIndex(self.x_values, self.y_values)
+        self._updating = False
+
+        self.markers = ax.scatter(self.x_values[:0], self.y_values[:0], c=self.labels[:0],
+                                  cmap=cmap, norm=norm, s=s, alpha=alpha)
+        self.image = ax.imshow(np.zeros((1, 1, 4)), origin='lower', aspect='auto', interpolation='nearest',
+                               extent=(self.index.x_min, self.index.x_max, self.index.y_min, self.index.y_max))
+
+        ax.margins(0.05)
+        ax.autoscale_view()
+        self.update()
+
+        ax.callbacks.connect('xlim_changed', self.update)
+        ax.callbacks.connect('ylim_changed', self.update)
+
+    def update(self, *args):
+        if self._updating:
+            return
+        self._updating = True
+
+        x_min, x_max = self.ax.get_xlim()
+        y_min, y_max = self.ax.get_ylim()
+        visible = np.flatnonzero((self.x_values >= x_min) & (self.x_values <= x_max) &
+                                 (self.y_values >= y_min) & (self.y_values <= y_max))
+
+        if len(visible) <= self.max_markers:
+            self.markers.set_offsets(np.column_stack((self.x_values[visible], self.y_values[visible])))
+            self.markers.set_array(self.labels[visible])
+            self.markers.set_visible(True)
+            self.image.set_visible(False)
+        else:
+            bbox = self.ax.get_window_extent()
+            shape = (max(int(bbox.height / PIXELS_PER_BIN), 1), max(int(bbox.width / PIXELS_PER_BIN), 1))
+            extent = (x_min, x_max, y_min, y_max)
+            self.image.set_data(rasterizeCategories(self.x_values[visible], self.y_values[visible],
+                                                    self.labels[visible], self.colors, extent, shape))
+            self.image.set_extent(extent)
+            self.image.set_visible(True)
+            self.markers.set_visible(False)
+
+        self._updating = False
+        self.ax.figure.canvas.draw_idle()
+
+    # Index of the point under a mouse event, within HOVER_TOLERANCE pixels
+    def pointAt(self, event):
+        bbox = self.ax.get_window_extent()
+        x_min, x_max = self.ax.get_xlim()
+        y_min, y_max = self.ax.get_ylim()
+        x_tolerance = HOVER_TOLERANCE * abs(x_max - x_min) / max(bbox.width, 1.)
+        y_tolerance = HOVER_TOLERANCE * abs(y_max - y_min) / max(bbox.height, 1.)
+        return self.index.nearest(event.xdata, event.ydata, x_tolerance, y_tolerance)
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import hashlib
+import fnmatch
+
+import numpy as np
+
+from pele_manifest import getEpoch, getTrajectoryNumber
+
+
+PARTIAL_VERSION = 2
+MATCHES_PARTIAL = "matches"
+TRACKING_PARTIAL = "tracking"
+PARTIAL_EXTENSION = ".npz"
+
+
+def addShardArguments(group):
+    group.add_argument("-sg", "--shard-glob", metavar="PATTERN", type=str, help="only analyze trajectories whose path matches this pattern, relative patterns are resolved against the working directory", default=None)
+    group.add_argument("-se", "--shard-epochs", metavar="FIRST:LAST", type=str, help="only analyze trajectories of this inclusive epoch range", default=None)
+    group.add_argument("-sm", "--shard", metavar="INDEX/COUNT", type=str, help="only analyze trajectories whose index modulo COUNT equals INDEX", default=None)
+    group.add_argument("-P", "--partial", metavar="PATH", type=str, help="save a partial result file to be combined with merge_partials.py", default=None)
+
+
+def parseShardArguments(args, parser):
+    epochs = None
+    if args.shard_epochs is not None:
+        try:
+            first, last = args.shard_epochs.split(':')
+            epochs = (int(first) if first else None, int(last) if last else None)
+        except ValueError:
+            print("Error: epoch range not recognized: {}".format(args.shard_epochs))
+            parser.print_help()
+            exit(1)
+
+    shard = None
+    if args.shard is not None:
+        try:
+            index, count = map(int, args.shard.split('/'))
+        except ValueError:
+            index, count = -1, 0
+        if count < 1 or not 0 <= index < count:
+            print("Error: shard not recognized: {}".format(args.shard))
+            parser.print_help()
+            exit(1)
+        shard = (index, count)
+
+    # Trajectories are matched by absolute path. Patterns starting with a
+    # wildcard already match any prefix and are kept as given.
+    glob = args.shard_glob
+    if glob is not None and not os.path.isabs(glob) and not glob.startswith('*'):
+        glob = os.path.abspath(glob)
+
+    partial_path = None
+    if args.partial is not None:
+        partial_path = os.path.abspath(args.partial)
+
+    return {"glob": glob, "epochs": epochs, "shard": shard}, partial_path
+
+
+def isSharded(shard_selection):
+    return any(value is not None for value in shard_selection.values())
+
+
+def hashTrajectories(trajectories):
+    return hashlib.sha1("\n".join(trajectories).encode("utf-8")).hexdigest()
+
+
+# Trajectories are sorted so that every shard of a job array agrees on the
+# global index of each trajectory, regardless of the order glob returns them.
+# The hash of the sorted list lets merging detect shards that saw a different
+# set of trajectories, e.g. when new epochs were written in between.
+def selectShard(trajectories, shard_selection):
+    all_trajectories = sorted(set(os.path.abspath(trajectory) for trajectory in trajectories))
+    selected = []
+
+    for index, trajectory in enumerate(all_trajectories):
+        if shard_selection["shard"] is not None:
+            shard_index, shard_count = shard_selection["shard"]
+            if index % shard_count != shard_index:
+                continue
+        if shard_selection["glob"] is not None and not fnmatch.fnmatch(trajectory, shard_selection["glob"]):
+            continue
+        if shard_selection["epochs"] is not None:
+            epoch = int(getEpoch(os.path.dirname(trajectory)))
+            first, last = shard_selection["epochs"]
+            if (first is not None and epoch < first) or (last is not None and epoch > last):
+                continue
+        selected.append((index, trajectory))
+
+    # Empty shards are not an error, so that the rest of a job array and the
+    # jobs depending on it still run. Merging reports the coverage.
+    if len(selected) == 0:
+        print("Warning: none of the {} trajectories belong to this shard".format(len(all_trajectories)))
+
+    return selected, len(all_trajectories), hashTrajectories(all_trajectories)
+
+
+def describeTrajectories(shard_trajectories):
+    return [{"index": index,
+             "path": trajectory,
+             "epoch": getEpoch(os.path.dirname(trajectory)),
+             "number": getTrajectoryNumber(trajectory)} for index, trajectory in shard_trajectories]
+
+
+def concatenateSegments(segments, shape=(), dtype=np.float64):
+    offsets = np.zeros(len(segments) + 1, dtype=np.int64)
+    if len(segments) > 0:
+        offsets[1:] = np.cumsum([len(segment) for segment in segments])
+        data = np.concatenate([np.asarray(segment, dtype=dtype).reshape((-1, ) + shape) for segment in segments])
+    else:
+        data = np.empty((0, ) + shape, dtype=dtype)
+    return data, offsets
+
+
+def savePartial(partial_path, kind, settings, shard_trajectories, total_trajectories, trajectories_hash, **arrays):
+    if not partial_path.endswith(PARTIAL_EXTENSION):
+        partial_path += PARTIAL_EXTENSION
+
+    metadata = {"version": PARTIAL_VERSION,
+                "kind": kind,
+                "settings": settings,
+                "total_trajectories": total_trajectories,
+                "trajectories_hash": trajectories_hash,
+                "trajectories": describeTrajectories(shard_trajectories)}
+    np.savez_compressed(partial_path, metadata=np.array(json.dumps(metadata)), **arrays)
+
+    return partial_path
+
+
+def loadPartial(partial_path):
+    with np.load(partial_path) as partial_file:
+        metadata = json.loads(partial_file["metadata"].item())
+        arrays = dict((name, partial_file[name]) for name in partial_file.files if name != "metadata")
+
+    if metadata.get("version") != PARTIAL_VERSION:
+        raise IOError("Unsupported partial result version in {}".format(partial_path))
+
+    return metadata, arrays
+
+
+def loadPartials(partial_paths):
+    partials = [loadPartial(partial_path) for partial_path in partial_paths]
+    if len(partials) == 0:
+        raise IOError("No partial result files were supplied")
+
+    kind = partials[0][0]["kind"]
+    settings = partials[0][0]["settings"]
+    total_trajectories = partials[0][0]["total_trajectories"]
+    trajectories_hash = partials[0][0]["trajectories_hash"]
+    for partial_path, (metadata, arrays) in zip(partial_paths, partials):
+        if metadata["kind"] != kind or metadata["settings"] != settings:
+            raise IOError("Partial result {} was produced by a different analysis".format(partial_path))
+        # Global indices are only comparable between shards of the same list
+        if metadata["total_trajectories"] != total_trajectories or metadata["trajectories_hash"] != trajectories_hash:
+            raise IOError("Partial result {} was produced from a different list of trajectories".format(partial_path))
+
+    paths = [trajectory["path"] for metadata, arrays in partials for trajectory in metadata["trajectories"]]
+    if len(paths) != len(set(paths)):
+        print("Warning: some trajectories appear in more than one partial result, only their first occurrence is kept")
+    missing = total_trajectories - len(set(paths))
+    if missing > 0:
+        print("Warning: {} trajectories are not covered by the supplied partial results".format(missing))
+
+    return kind, settings, partials
+
+
+# Yields (trajectory, arrays, segment) for every trajectory in global index
+# order, where segment is the position of the trajectory inside its partial
+def iterateTrajectories(partials):
+    entries = []
+    for metadata, arrays in partials:
+        for segment, trajectory in enumerate(metadata["trajectories"]):
+            entries.append((trajectory["index"], trajectory, arrays, segment))
+    entries.sort(key=lambda entry: entry[0])
+
+    seen = set()
+    for index, trajectory, arrays, segment in entries:
+        if trajectory["path"] in seen:
+            continue
+        seen.add(trajectory["path"])
+        yield trajectory, arrays, segment
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+
+class Model(object):
+    def __init__(self, number, records, names, residue_names, chains, residue_ids, elements, coordinates):
+        self.number = number
+        self.records = np.array(records)
+        self.names = np.array(names)
+        self.residue_names = np.array(residue_names)
+        self.chains = np.array(chains)
+        self.residue_ids = np.array(residue_ids)
+        self.elements = np.array(elements)
+        self.coordinates = np.array(coordinates, dtype=np.float64).reshape(-1, 3)
+
+    def __len__(self):
+        return len(self.coordinates)
+
+    def residueLabels(self, indices):
+        return ["{}:{}".format(self.chains[i], self.residue_ids[i]) for i in indices]
+
+
+def getElement(line):
+    element = line[76:78].strip()
+    if element:
+        return element.upper()
+    # Without element column, use the first letter of the atom name
+    return line[12:16].strip().lstrip('0123456789')[:1].upper()
+
+
+def parseModelLines(number, lines):
+    records = []
+    names = []
+    residue_names = []
+    chains = []
+    residue_ids = []
+    elements = []
+    coordinates = []
+
+    for line in lines:
+        records.append(line[:6].strip())
+        names.append(line[12:16].strip())
+        residue_names.append(line[17:20].strip())
+        chains.append(line[21])
+        residue_ids.append(line[22:26].strip())
+        elements.append(getElement(line))
+        coordinates.append((float(line[30:38]), float(line[38:46]), float(line[46:54])))
+
+    return Model(number, records, names, residue_names, chains, residue_ids, elements, coordinates)
+
+
+# Yields the models of a PELE trajectory. Models are numbered from the first
+# MODEL record onwards, as in water_matching.getModelWaterMatches.
+def iterateModels(trajectory):
+    number = None
+    lines = []
+
+    with open(trajectory, 'r') as pdb_file:
+        for line in pdb_file:
+            if line.startswith("MODEL"):
+                if number is not None:
+                    yield parseModelLines(number, lines)
+                    number += 1
+                else:
+                    fields = line.split()
+                    number = int(fields[1]) if len(fields) > 1 else 1
+                lines = []
+            elif line.startswith("ATOM") or line.startswith("HETATM"):
+                lines.append(line)
+
+    if len(lines) > 0:
+        yield parseModelLines(number if number is not None else 1, lines)
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+
+import argparse as ap
+import os
+import sys
+import numpy as np
+
+from water_radius import parseTrajectories
+from trajectory_reader import iterateModels
+from pele_manifest import getEpoch, getTrajectoryNumber
+
+
+LIGAND_NAME = "LIG"
+WATER_NAME = "HOH"
+CONTACT_CUTOFF = 4.0
+HBOND_DISTANCE = 3.5
+HBOND_ANGLE = 120.
+COVALENT_H_DISTANCE = 1.25
+POLAR_ELEMENTS = ("N", "O")
+OFFSETS = np.array([(i, j, k) for i in (-1, 0, 1) for j in (-1, 0, 1) for k in (-1, 0, 1)])
+
+
+class CellList(object):
+    # Bins the atoms of a set into cubic cells of side cutoff, so that every
+    # neighbour within cutoff lies in one of the 27 surrounding cells
+    def __init__(self, coordinates, cutoff, origin):
+        self.cutoff = float(cutoff)
+        self.origin = origin
+        cells = np.floor((coordinates - origin) / self.cutoff).astype(np.int64)
+        self.shape = cells.max(axis=0) + 1 if len(cells) > 0 else np.ones(3, dtype=np.int64)
+        keys = self._keys(cells)
+        self.order = np.argsort(keys, kind='mergesort')
+        self.sorted_keys = keys[self.order]
+        self.coordinates = coordinates
+
+    def _keys(self, cells):
+        return (cells[:, 0] * self.shape[1] + cells[:, 1]) * self.shape[2] + cells[:, 2]
+
+    # Returns (i, j, distance) for every query atom i and cell-listed atom j
+    # closer than the cutoff
+    def pairs(self, coordinates):
+        cells = np.floor((coordinates - self.origin) / self.cutoff).astype(np.int64)
+        query_indices = []
+        list_indices = []
+
+        for offset in OFFSETS:
+            neighbours = cells + offset
+            valid = np.flatnonzero(np.all((neighbours >= 0) & (neighbours < self.shape), axis=1))
+            keys = self._keys(neighbours[valid])
+            starts = np.searchsorted(self.sorted_keys, keys, side='left')
+            counts = np.searchsorted(self.sorted_keys, keys, side='right') - starts
+            total = counts.sum()
+            if total == 0:
+                continue
+            # Expand every [start, start + count) range without a Python loop
+            first = np.repeat(np.cumsum(counts) - counts, counts)
+            positions = np.repeat(starts, counts) + np.arange(total) - first
+            query_indices.append(np.repeat(valid, counts))
+            list_indices.append(self.order[positions])
+
+        if len(query_indices) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+
+        query_indices = np.concatenate(query_indices)
+        list_indices = np.concatenate(list_indices)
+        distances = np.sqrt(((coordinates[query_indices] - self.coordinates[list_indices]) ** 2).sum(axis=1))
+        within = distances < self.cutoff
+
+        return query_indices[within], list_indices[within], distances[within]
+
+
+def findPairs(coordinates_a, coordinates_b, cutoff):
+    if len(coordinates_a) == 0 or len(coordinates_b) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+    origin = np.minimum(coordinates_a.min(axis=0), coordinates_b.min(axis=0))
+    return CellList(coordinates_b, cutoff, origin).pairs(coordinates_a)
+
+
+def findHydrogenBonds(model, donor_candidates, acceptor_candidates, distance=HBOND_DISTANCE, angle=HBOND_ANGLE):
+    # Returns (donor, acceptor) atom index pairs. Without explicit hydrogens in
+    # the model, only the donor-acceptor distance is checked.
+    coordinates = model.coordinates
+    donor_indices, acceptor_indices, _ = findPairs(coordinates[donor_candidates], coordinates[acceptor_candidates], distance)
+    donors = donor_candidates[donor_indices]
+    acceptors = acceptor_candidates[acceptor_indices]
+    different = model.residue_ids[donors] != model.residue_ids[acceptors]
+    different |= model.chains[donors] != model.chains[acceptors]
+    donors, acceptors = donors[different], acceptors[different]
+
+    hydrogens = np.flatnonzero(model.elements == "H")
+    if len(hydrogens) == 0:
+        # Without hydrogens the direction is unknown, and the same pair would
+        # be found once from each side. Keep every unordered pair once.
+        first, second = np.minimum(donors, acceptors), np.maximum(donors, acceptors)
+        _, unique_indices = np.unique(first * len(model) + second, return_index=True)
+        return first[unique_indices], second[unique_indices]
+
+    # Attach every hydrogen to its bonded polar atom
+    hydrogen_indices, polar_indices, _ = findPairs(coordinates[hydrogens], coordinates[donor_candidates], COVALENT_H_DISTANCE)
+    bonded_hydrogens = hydrogens[hydrogen_indices]
+    bonded_donors = donor_candidates[polar_indices]
+
+    # Join donor-acceptor pairs with the hydrogens of each donor
+    order = np.argsort(bonded_donors, kind='mergesort')
+    bonded_donors, bonded_hydrogens = bonded_donors[order], bonded_hydrogens[order]
+    starts = np.searchsorted(bonded_donors, donors, side='left')
+    counts = np.searchsorted(bonded_donors, donors, side='right') - starts
+    total = counts.sum()
+    if total == 0:
+        return donors[:0], acceptors[:0]
+    pair_indices = np.repeat(np.arange(len(donors)), counts)
+    positions = np.repeat(starts, counts) + np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    pair_hydrogens = bonded_hydrogens[positions]
+
+    to_donor = coordinates[donors[pair_indices]] - coordinates[pair_hydrogens]
+    to_acceptor = coordinates[acceptors[pair_indices]] - coordinates[pair_hydrogens]
+    cosines = (to_donor * to_acceptor).sum(axis=1) / (np.linalg.norm(to_donor, axis=1) * np.linalg.norm(to_acceptor, axis=1))
+    accepted = np.unique(pair_indices[cosines <= np.cos(np.radians(angle))])
+
+    return donors[accepted], acceptors[accepted]
+
+
+def analyzeModel(model, ligand_name=LIGAND_NAME, contact_cutoff=CONTACT_CUTOFF,
+                 hbond_distance=HBOND_DISTANCE, hbond_angle=HBOND_ANGLE):
+    heavy = model.elements != "H"
+    polar = np.in1d(model.elements, POLAR_ELEMENTS)
+    water = model.residue_names == WATER_NAME
+    ligand = model.residue_names == ligand_name
+    protein = (model.records == "ATOM") & ~water & ~ligand
+
+    water_atoms = np.flatnonzero(water & heavy)
+    ligand_atoms = np.flatnonzero(ligand & heavy)
+    protein_atoms = np.flatnonzero(protein & heavy)
+
+    water_ligand, _, _ = findPairs(model.coordinates[water_atoms], model.coordinates[ligand_atoms], contact_cutoff)
+    water_protein, _, _ = findPairs(model.coordinates[water_atoms], model.coordinates[protein_atoms], contact_cutoff)
+
+    polar_atoms = np.flatnonzero(polar & (water | ligand | protein))
+    donors, acceptors = findHydrogenBonds(model, polar_atoms, polar_atoms, hbond_distance, hbond_angle)
+
+    # Keep hydrogen bonds between a water and the ligand or the protein
+    water_donor = water[donors] & ~water[acceptors]
+    water_acceptor = water[acceptors] & ~water[donors]
+    bonded_waters = np.concatenate((donors[water_donor], acceptors[water_acceptor]))
+    partners = np.concatenate((acceptors[water_donor], donors[water_acceptor]))
+    ligand_hbond_waters = np.unique(model.residueLabels(bonded_waters[ligand[partners]]))
+    protein_hbond_waters = np.unique(model.residueLabels(bonded_waters[protein[partners]]))
+
+    return {"water_ligand_contacts": len(water_ligand),
+            "water_protein_contacts": len(water_protein),
+            "water_ligand_hbonds": int(ligand[partners].sum()),
+            "water_protein_hbonds": int(protein[partners].sum()),
+            "bridging_waters": sorted(set(ligand_hbond_waters) & set(protein_hbond_waters))}
+
+
+def parseArgs():
+    parser = ap.ArgumentParser()
+    optional = parser._action_groups.pop()
+    required = parser.add_argument_group('required arguments')
+    required.add_argument("-i", "--input", required=True, metavar="FILE", type=str, nargs='*', help="path to trajectory files")
+    optional.add_argument("-l", "--ligand", metavar="NAME", type=str, help="residue name of the ligand", default=LIGAND_NAME)
+    optional.add_argument("-c", "--contact", metavar="FLOAT", type=float, help="maximum heavy atom distance of a contact", default=CONTACT_CUTOFF)
+    optional.add_argument("-d", "--hbond-distance", metavar="FLOAT", type=float, help="maximum donor-acceptor distance of a hydrogen bond", default=HBOND_DISTANCE)
+    optional.add_argument("-a", "--hbond-angle", metavar="FLOAT", type=float, help="minimum donor-hydrogen-acceptor angle of a hydrogen bond", default=HBOND_ANGLE)
+    optional.add_argument("-o", "--output", metavar="PATH", type=str, help="output path to save the per-model results", default=None)
+    parser._action_groups.append(optional)
+    args = parser.parse_args()
+
+    trajectories = parseTrajectories(args.input, parser)
+
+    return trajectories, args.ligand, args.contact, args.hbond_distance, args.hbond_angle, args.output
+
+
+def main():
+    trajectories, ligand_name, contact_cutoff, hbond_distance, hbond_angle, output_path = parseArgs()
+
+    if output_path is not None:
+        output_file = open(output_path, 'w')
+    else:
+        output_file = sys.stdout
+
+    output_file.write("#epoch    trajectory    model    water_ligand_contacts    water_protein_contacts    "
+                      "water_ligand_hbonds    water_protein_hbonds    bridging_waters\n")
+
+    for trajectory in trajectories:
+        epoch = getEpoch(os.path.dirname(trajectory))
+        traj_number = getTrajectoryNumber(trajectory)
+
+        for model in iterateModels(trajectory):
+            results = analyzeModel(model, ligand_name, contact_cutoff, hbond_distance, hbond_angle)
+            output_file.write("{}    {}    {}    {}    {}    {}    {}    {}\n".format(
+                epoch, traj_number, model.number,
+                results["water_ligand_contacts"], results["water_protein_contacts"],
+                results["water_ligand_hbonds"], results["water_protein_hbonds"],
+                ",".join(results["bridging_waters"]) if results["bridging_waters"] else "-"))
+
+    if output_path is not None:
+        output_file.close()
+        print "Results saved at:", output_path
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+
+import argparse as ap
+import os
+import json
+import sqlite3
+from math import isnan
+
+from water_matching import getWaterReferenceSites, getModelWaterMatches, assignWaterSites
+from pele_manifest import findTrajectories, getEpoch, getTrajectoryNumber
+
+
+DATABASE_NAME = "water_analysis.db"
+REPORT_NAME = "run_report"
+TRAJECTORY_NAME = "trajectory"
+
+# Database column and PELE report column holding the same value
+REPORT_COLUMNS = (("step", "Step"),
+                  ("accepted_steps", "numberOfAcceptedPeleSteps"),
+                  ("current_energy", "currentEnergy"),
+                  ("binding_energy", "Binding Energy"),
+                  ("distance", "COM DISTANCE"),
+                  ("rmsd", "proteinLigandDistance"))
+MODEL_COLUMNS = ("run", "epoch", "trajectory", "model") + tuple(column for column, name in REPORT_COLUMNS) + ("sites_filled", )
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS settings (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS sites (
+    site INTEGER PRIMARY KEY,
+    water TEXT,
+    x REAL,
+    y REAL,
+    z REAL
+);
+CREATE TABLE IF NOT EXISTS trajectories (
+    id INTEGER PRIMARY KEY,
+    run TEXT,
+    directory TEXT,
+    epoch INTEGER,
+    trajectory INTEGER,
+    path TEXT UNIQUE,
+    report TEXT,
+    report_header TEXT,
+    size INTEGER,
+    mtime REAL,
+    report_size INTEGER,
+    report_mtime REAL
+);
+CREATE TABLE IF NOT EXISTS models (
+    trajectory_id INTEGER,
+    run TEXT,
+    epoch INTEGER,
+    trajectory INTEGER,
+    model INTEGER,
+    step REAL,
+    accepted_steps REAL,
+    current_energy REAL,
+    binding_energy REAL,
+    distance REAL,
+    rmsd REAL,
+    sites_filled INTEGER,
+    report_values TEXT,
+    PRIMARY KEY (trajectory_id, model)
+);
+CREATE TABLE IF NOT EXISTS occupancy (
+    trajectory_id INTEGER,
+    model INTEGER,
+    site INTEGER,
+    PRIMARY KEY (trajectory_id, model, site)
+);
+CREATE INDEX IF NOT EXISTS trajectories_directory ON trajectories (directory);
+CREATE INDEX IF NOT EXISTS models_epoch ON models (epoch);
+CREATE INDEX IF NOT EXISTS models_trajectory ON models (run, trajectory);
+CREATE INDEX IF NOT EXISTS models_model ON models (model);
+CREATE INDEX IF NOT EXISTS models_current_energy ON models (current_energy);
+CREATE INDEX IF NOT EXISTS models_binding_energy ON models (binding_energy);
+CREATE INDEX IF NOT EXISTS models_distance ON models (distance);
+CREATE INDEX IF NOT EXISTS models_rmsd ON models (rmsd);
+CREATE INDEX IF NOT EXISTS models_sites_filled ON models (sites_filled, binding_energy);
+CREATE INDEX IF NOT EXISTS occupancy_site ON occupancy (site);
+"""
+
+
+def connectDatabase(database_path):
+    connection = sqlite3.connect(database_path)
+    connection.row_factory = sqlite3.Row
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def checkSettings(connection, reference, waters, radius):
+    settings = {"reference": os.path.abspath(reference),
+                "waters": json.dumps([chain + ":" + residue_id for chain, residue_id in waters]),
+                "radius": repr(float(radius))}
+    stored = dict((row["name"], row["value"]) for row in connection.execute("SELECT name, value FROM settings"))
+
+    if len(stored) == 0:
+        connection.executemany("INSERT INTO settings (name, value) VALUES (?, ?)", settings.items())
+        return True
+
+    return stored == settings
+
+
+def storeSites(connection, water_sites):
+    # Site indices must match the positions of the locations passed to
+    # waterInSphere
+    connection.execute("DELETE FROM sites")
+    connection.executemany("INSERT INTO sites (site, water, x, y, z) VALUES (?, ?, ?, ?, ?)",
+                           [(site, chain + ":" + residue_id, float(x), float(y), float(z))
+                            for site, ((chain, residue_id), (x, y, z)) in enumerate(water_sites)])
+
+
+def parseReport(report):
+    with open(report, 'r') as report_file:
+        header = [name.strip() for name in report_file.readline().lstrip('#').split('    ') if name.strip()]
+        rows = []
+        for line in report_file:
+            if not line.strip():
+                continue
+            values = [float(field) for field in line.split()]
+            # NaN is not valid JSON nor a valid SQLite value, store NULL instead
+            rows.append([None if isnan(value) else value for value in values])
+
+    return header, rows
+
+
+def getReportColumn(header, row, name):
+    if name in header:
+        position = header.index(name)
+        if position < len(row):
+            return row[position]
+    return None
+
+
+# File sizes and mtimes are taken from the manifest pair when given, so that
+# unchanged trajectories are skipped without touching the files
+def ingestTrajectory(connection, run, trajectory, report, water_locations, radius, pair=None):
+    if pair is not None:
+        size, mtime, report_size, report_mtime = pair["size"], pair["mtime"], pair["report_size"], pair["report_mtime"]
+    else:
+        trajectory_stat = os.stat(trajectory)
+        report_stat = os.stat(report)
+        size, mtime = trajectory_stat.st_size, trajectory_stat.st_mtime
+        report_size, report_mtime = report_stat.st_size, report_stat.st_mtime
+
+    known = connection.execute("SELECT id, size, mtime, report_size, report_mtime FROM trajectories WHERE path = ?",
+                               (trajectory, )).fetchone()
+    if (known is not None and known["size"] == size and known["mtime"] == mtime and
+            known["report_size"] == report_size and known["report_mtime"] == report_mtime):
+        return False
+
+    header, rows = parseReport(report)
+    results = getModelWaterMatches(trajectory, water_locations, radius)
+
+    if known is not None:
+        trajectory_id = known["id"]
+        connection.execute("DELETE FROM models WHERE trajectory_id = ?", (trajectory_id, ))
+        connection.execute("DELETE FROM occupancy WHERE trajectory_id = ?", (trajectory_id, ))
+        connection.execute("DELETE FROM trajectories WHERE id = ?", (trajectory_id, ))
+    else:
+        trajectory_id = None
+
+    epoch = int(getEpoch(os.path.dirname(trajectory)))
+    number = int(getTrajectoryNumber(trajectory))
+    cursor = connection.execute("INSERT INTO trajectories (id, run, directory, epoch, trajectory, path, report, report_header, "
+                                "size, mtime, report_size, report_mtime) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                (trajectory_id, run, os.path.dirname(trajectory), epoch, number, trajectory, report,
+                                 json.dumps(header), size, mtime, report_size, report_mtime))
+    trajectory_id = cursor.lastrowid
+
+    # The i-th report line describes the (i + 1)-th model of the trajectory
+    models = []
+    occupancy = []
+    for i, row in enumerate(rows):
+        model = i + 1
+        sites_filled = None
+        if model in results:
+            assignments = assignWaterSites(results[model])
+            sites_filled = len(assignments)
+            occupancy += [(trajectory_id, model, site) for site, water in assignments]
+        models.append((trajectory_id, run, epoch, number, model) +
+                      tuple(getReportColumn(header, row, name) for column, name in REPORT_COLUMNS) +
+                      (sites_filled, json.dumps(row)))
+
+    connection.executemany("INSERT INTO models (trajectory_id, run, epoch, trajectory, model, " +
+                           ", ".join(column for column, name in REPORT_COLUMNS) +
+                           ", sites_filled, report_values) VALUES (" + ", ".join(["?"] * (len(REPORT_COLUMNS) + 7)) + ")",
+                           models)
+    connection.executemany("INSERT INTO occupancy (trajectory_id, model, site) VALUES (?, ?, ?)", occupancy)
+
+    return True
+
+
+def ingestRuns(connection, runs, water_locations, radius, trajectory_name=TRAJECTORY_NAME, report_name=REPORT_NAME):
+    ingested = 0
+    skipped = 0
+
+    for run in runs:
+        run = os.path.abspath(run)
+        for pair in findTrajectories(run, trajectory_name, report_name):
+            if pair["report"] is None:
+                print("Warning: no report found for \'{}\', skipping it".format(pair["trajectory"]))
+                continue
+            if ingestTrajectory(connection, run, pair["trajectory"], pair["report"], water_locations, radius, pair):
+                ingested += 1
+            else:
+                skipped += 1
+        connection.commit()
+
+    return ingested, skipped
+
+
+def queryModels(connection, min_sites=None, max_distance=None, max_rmsd=None, epochs=None, run=None,
+                directory=None, order_by="binding_energy", descending=False, limit=None):
+    if order_by not in MODEL_COLUMNS:
+        raise ValueError("Unknown column: {}".format(order_by))
+
+    conditions = []
+    parameters = []
+    if min_sites is not None:
+        conditions.append("m.sites_filled >= ?")
+        parameters.append(min_sites)
+    if max_distance is not None:
+        conditions.append("m.distance < ?")
+        parameters.append(max_distance)
+    if max_rmsd is not None:
+        conditions.append("m.rmsd <= ?")
+        parameters.append(max_rmsd)
+    if epochs is not None:
+        conditions.append("m.epoch IN (" + ", ".join(["?"] * len(epochs)) + ")")
+        parameters += list(epochs)
+    if run is not None:
+        conditions.append("m.run = ?")
+        parameters.append(os.path.abspath(run))
+    if directory is not None:
+        conditions.append("m.trajectory_id IN (SELECT id FROM trajectories WHERE directory = ?)")
+        parameters.append(os.path.abspath(directory))
+
+    query = "SELECT " + ", ".join("m." + column for column in MODEL_COLUMNS) + " FROM models m"
+    if len(conditions) > 0:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY m.{} {}".format(order_by, "DESC" if descending else "ASC")
+    if limit is not None:
+        query += " LIMIT ?"
+        parameters.append(limit)
+
+    return connection.execute(query, parameters).fetchall()
+
+
+def getDatabasePlotData(connection, trajectories, x_rows, y_rows):
+    connection.execute("CREATE TEMP TABLE IF NOT EXISTS selected_trajectories (path TEXT PRIMARY KEY)")
+    connection.execute("DELETE FROM selected_trajectories")
+    connection.executemany("INSERT OR IGNORE INTO selected_trajectories (path) VALUES (?)",
+                           [(os.path.abspath(trajectory), ) for trajectory in trajectories])
+
+    x_sum = " + ".join("json_extract(m.report_values, '$[{}]')".format(int(row) - 1) for row in x_rows)
+    y_sum = " + ".join("json_extract(m.report_values, '$[{}]')".format(int(row) - 1) for row in y_rows)
+    rows = connection.execute("SELECT m.epoch, m.trajectory, m.model, m.sites_filled, " + x_sum + " AS x, " + y_sum + " AS y "
+                              "FROM selected_trajectories s JOIN trajectories t ON t.path = s.path "
+                              "JOIN models m ON m.trajectory_id = t.id "
+                              "WHERE x IS NOT NULL AND y IS NOT NULL AND m.sites_filled IS NOT NULL "
+                              "ORDER BY t.id, m.model").fetchall()
+
+    missing = connection.execute("SELECT COUNT(*) FROM selected_trajectories s "
+                                 "LEFT JOIN trajectories t ON t.path = s.path WHERE t.id IS NULL").fetchone()[0]
+    if missing > 0:
+        print("Warning: {} trajectories are not in the database, run the ingest command first".format(missing))
+
+    return rows
+
+
+def printModels(rows):
+    print("  ".join("{:>14}".format(column) for column in MODEL_COLUMNS[1:]))
+    for row in rows:
+        print("  ".join("{:>14}".format("-" if row[column] is None else
+                                       "{:.3f}".format(row[column]) if isinstance(row[column], float) else row[column])
+                        for column in MODEL_COLUMNS[1:]))
+
+
+def parseResidues(residues_to_parse):
+    waters = []
+
+    for water_list in residues_to_parse:
+        for water in water_list.split(','):
+            water_identifiers = water.strip().split(':')
+            if len(water_identifiers) == 2:
+                chain, residue_id = water_identifiers
+                waters.append((chain, residue_id))
+
+    return waters
+
+
+def parseArgs():
+    parser = ap.ArgumentParser()
+    parser.add_argument("-db", "--database", metavar="PATH", type=str, help="path to the SQLite database", default=DATABASE_NAME)
+    subparsers = parser.add_subparsers(dest="command")
+
+    ingest = subparsers.add_parser("ingest", help="add new or modified trajectories and reports to the database")
+    ingest.add_argument("-i", "--input", required=True, metavar="PATH", type=str, nargs='*', help="path to PELE output directories")
+    ingest.add_argument("-r", "--ref", required=True, metavar="FILE", type=str, help="path to reference structure file")
+    ingest.add_argument("-w", "--waters", required=True, metavar="CHAIN:ID", type=str, nargs='*', help="list of water ids")
+    ingest.add_argument("-R", "--radius", metavar="FLOAT", type=float, help="radius of the sphere to look for waters", default=1.5)
+    ingest.add_argument("-t", "--trajectory", metavar="NAME", type=str, help="Trajectory file name", default=TRAJECTORY_NAME)
+    ingest.add_argument("-rp", "--report", metavar="NAME", type=str, help="Report file name", default=REPORT_NAME)
+
+    query = subparsers.add_parser("query", help="list the models matching some criteria")
+    query.add_argument("-s", "--min-sites", metavar="INTEGER", type=int, help="minimum number of filled water sites", default=None)
+    query.add_argument("-d", "--max-distance", metavar="FLOAT", type=float, help="maximum accepted water distance", default=None)
+    query.add_argument("-m", "--max-rmsd", metavar="FLOAT", type=float, help="maximum accepted RMSD", default=None)
+    query.add_argument("-e", "--epochs", metavar="INTEGER", type=int, nargs='*', help="only consider these epochs", default=None)
+    query.add_argument("-u", "--run", metavar="PATH", type=str, help="only consider this PELE output directory", default=None)
+    query.add_argument("-S", "--sort", metavar="COLUMN", type=str, choices=MODEL_COLUMNS, help="column to sort by", default="binding_energy")
+    query.add_argument("-D", "--descending", action="store_true", help="sort in descending order")
+    query.add_argument("-n", "--limit", metavar="INTEGER", type=int, help="maximum number of models to list", default=10)
+
+    args = parser.parse_args()
+    if args.command is None:
+        parser.print_help()
+        exit(1)
+
+    return args
+
+
+def main():
+    args = parseArgs()
+    connection = connectDatabase(args.database)
+
+    if args.command == "ingest":
+        waters = parseResidues(args.waters)
+        if len(waters) == 0:
+            print("Error: list of water ids is empty. No correct water ids were detected.")
+            exit(1)
+        if not checkSettings(connection, args.ref, waters, args.radius):
+            print("Error: the database was built with a different reference, water list or radius")
+            exit(1)
+        water_sites = getWaterReferenceSites(args.ref, waters)
+        if len(water_sites) == 0:
+            print("Error: none of the water ids were found in the reference structure")
+            exit(1)
+        storeSites(connection, water_sites)
+        water_locations = [location for water, location in water_sites]
+        print(" - Ingesting trajectories...")
+        ingested, skipped = ingestRuns(connection, args.input, water_locations, args.radius,
+                                       args.trajectory, args.report)
+        print("{} trajectories ingested, {} unchanged".format(ingested, skipped))
+
+    elif args.command == "query":
+        rows = queryModels(connection, min_sites=args.min_sites, max_distance=args.max_distance,
+                           max_rmsd=args.max_rmsd, epochs=args.epochs, run=args.run,
+                           order_by=args.sort, descending=args.descending, limit=args.limit)
+        printModels(rows)
+
+    connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+import copy
+
+
+# Returns (water, location) pairs in the order of waters. Waters missing from
+# the reference are left out, so site indices follow the returned pairs.
+def getWaterReferenceSites(reference, waters):
+    found_locations = {}
+    waters_list =  copy.copy(waters)
+    with open(reference, "r") as ref_pdb:
+        for line in ref_pdb:
+            if not line.startswith('HETATM'):
+                continue
+            fields = line.split()
+            if fields[3] != 'HOH' and fields[2] != 'O':
+                continue
+            for i, water in enumerate(waters_list):
+                chain, residue_id = water
+                if fields[4] == chain and fields[5] == residue_id:
+                    found_locations[tuple(water)] = [j for j in fields[6:9]]
+                    del(waters_list[i])
+                    break
+
+    if len(waters_list) != 0:
+        print("Warning: the following water residues could not be found in the reference structure:")
+        for water in waters_list:
+            print("{}:{}".format(*water))
+
+    return [(water, found_locations[tuple(water)]) for water in waters if tuple(water) in found_locations]
+
+
+def getWaterReferenceLocations(reference, waters):
+    return [location for water, location in getWaterReferenceSites(reference, waters)]
+
+
+def waterInSphere(coordinates, water_locations, radius):
+    squared_radius = pow(radius, 2)
+    matchs = []
+    for k, water_location in enumerate(water_locations):
+        squared_distance = sum([pow(float(i) - float(j), 2) for i, j in zip(coordinates, water_location)])
+        if squared_distance < squared_radius:
+            matchs.append(k)
+    return matchs
+
+
+def getModelWaterMatches(trajectory, water_locations, radius):
+    with open(trajectory, "r") as pdb_file:
+        results = {}
+        model = int(pdb_file.readline().split()[1])
+        results[model] = {}
+        for line in pdb_file:
+            if line.startswith("MODEL"):
+                model += 1
+                results[model] = {}
+                continue
+            if not line.startswith('HETATM'):
+                continue
+            fields = line.split()
+            if fields[3] != 'HOH' or fields[2] != 'OW':
+                continue
+
+            coordinates = fields[6:9]
+            results[model][fields[4] + fields[5]] = waterInSphere(coordinates, water_locations, radius)
+
+    return results
+
+
+# Greedily assigns sites to waters, starting with the waters that fall inside
+# the largest number of spheres. Returns (site, water) pairs.
+def assignWaterSites(water_matchs):
+    sorted_waters = sorted(water_matchs, key=lambda k: len(water_matchs[k]), reverse=True)
+
+    match_set = []
+    assignments = []
+    for water in sorted_waters:
+        for match in water_matchs[water]:
+            if match not in match_set:
+                match_set.append(match)
+                assignments.append((match, water))
+                break
+
+    return assignments
@@ -5,9 +5,14 @@ import argparse as ap
 import os
 import glob
 import sys
-import copy
+import numpy as np
 from matplotlib import pyplot, patches
 from math import isnan
+from scatter_rendering import DensityScatter, MAX_MARKERS
+from pele_manifest import findTrajectories, getEpoch, getTrajectoryNumber
+from water_matching import getWaterReferenceLocations, getModelWaterMatches, assignWaterSites
+from water_database import connectDatabase, getDatabasePlotData
+from shard_analysis import addShardArguments, parseShardArguments, isSharded, selectShard, concatenateSegments, savePartial, MATCHES_PARTIAL
 
 
 PROGRESS_BAR_WIDTH = 40
@@ -31,22 +36,38 @@ def parseResidues(residues_to_parse):
     return waters
 
 
-def parseTrajectories(trajectories_to_parse, parser):
-    trajectories = []
+# Returns the trajectories paired with their reports. PELE output directories
+# are paired through their cached manifest, the report of a trajectory given
+# by path is only assumed to be next to it.
+def parseTrajectoryPairs(trajectories_to_parse, parser, report_name=REPORT_NAME):
+    pairs = []
 
     for trajectory_list in trajectories_to_parse:
-        trajectories_found = glob.glob(trajectory_list)
-        if len(trajectories_found) == 0:
+        if os.path.isdir(trajectory_list):
+            pairs_found = findTrajectories(trajectory_list, report_name=report_name)
+        else:
+            pairs_found = []
+            for trajectory in glob.glob(trajectory_list):
+                traj_directory = os.path.dirname(trajectory)
+                traj_number = getTrajectoryNumber(trajectory)
+                pairs_found.append({"trajectory": trajectory,
+                                    "report": os.path.join(traj_directory, report_name + "_" + traj_number),
+                                    "epoch": getEpoch(traj_directory),
+                                    "number": traj_number})
+        if len(pairs_found) == 0:
             print "Warning: trajectory path \'", trajectory_list, "\' not found."
-        for trajectory in glob.glob(trajectory_list):
-            trajectories.append(trajectory)
+        pairs += pairs_found
 
-    if len(trajectories) == 0:
+    if len(pairs) == 0:
         print "Error: list of trajectories is empty."
         parser.print_help()
         exit(1)
 
-    return trajectories
+    return pairs
+
+
+def parseTrajectories(trajectories_to_parse, parser):
+    return [pair["trajectory"] for pair in parseTrajectoryPairs(trajectories_to_parse, parser)]
 
 
 def parseArgs():
@@ -55,12 +76,15 @@ def parseArgs():
     required = parser.add_argument_group('required arguments')
     required.add_argument("-r", "--ref", required=True, metavar="FILE", type=str, help="path to reference structure file")
     required.add_argument("-w", "--waters", metavar="CHAIN:ID", type=str, nargs='*', help="list of water ids", default=[])
-    required.add_argument("-i", "--input", required=True, metavar="FILE", type=str, nargs='*', help="path to trajectory files")
+    required.add_argument("-i", "--input", required=True, metavar="FILE", type=str, nargs='*', help="path to trajectory files or PELE output directories")
     optional.add_argument("-R", "--radius", metavar="FLOAT", type=float, help="radius of the sphere to look for waters", default=1.5)
     optional.add_argument("-X", "--xaxis", metavar="INTEGER [METRIC]", type=str, nargs='*', help="column number and metric to plot on the X axis", default=None)
     optional.add_argument("-Y", "--yaxis", metavar="INTEGER [METRIC]", type=str, nargs='*', help="column number and metric to plot on the Y axis", default=None)
     optional.add_argument("-o", "--output", metavar="PATH", type=str, help="output path to save figure", default=None)
     optional.add_argument("-rp", "--report", metavar="PATH", type=str, help="Report file name", default=REPORT_NAME)
+    optional.add_argument("-M", "--markers", metavar="INTEGER", type=int, help="maximum number of visible points drawn as markers, denser views are rasterized", default=MAX_MARKERS)
+    optional.add_argument("-db", "--database", metavar="PATH", type=str, help="read matches and report values from a database built with water_database.py", default=None)
+    addShardArguments(optional)
     parser._action_groups.append(optional)
     args = parser.parse_args()
 
@@ -72,7 +96,10 @@ def parseArgs():
 
     waters = parseResidues(args.waters)
 
-    trajectories = parseTrajectories(args.input, parser)
+    trajectory_pairs = parseTrajectoryPairs(args.input, parser, args.report)
+    trajectories = [pair["trajectory"] for pair in trajectory_pairs]
+    reports = dict(((os.path.abspath(os.path.dirname(pair["trajectory"])), pair["number"]), pair)
+                   for pair in trajectory_pairs)
 
     radius = args.radius
 
@@ -83,41 +110,17 @@ def parseArgs():
 
     output_path = args.output
 
-    return reference, waters, trajectories, radius, x_data, y_data, output_path, report_name
-
-def getWaterReferenceLocations(reference, waters):
-    water_locations = []
-    waters_list =  copy.copy(waters)
-    with open(reference, "r") as ref_pdb:
-        for line in ref_pdb:
-            if not line.startswith('HETATM'):
-                continue
-            fields = line.split()
-            if fields[3] != 'HOH' and fields[2] != 'O':
-                continue
-            for i, water in enumerate(waters_list):
-                chain, residue_id = water
-                if fields[4] == chain and fields[5] == residue_id:
-                    water_locations.append([j for j in fields[6:9]])
-                    del(waters_list[i])
-                    break
-
-    if len(waters_list) != 0:
-        print "Warning: the following water residues could not be found in the reference structure:"
-        for water in waters_list:
-            print water
-
-    return water_locations
-
-
-def waterInSphere(coordinates, water_locations, radius):
-    squared_radius = pow(radius, 2)
-    matchs = []
-    for k, water_location in enumerate(water_locations):
-        squared_distance = sum([pow(float(i) - float(j), 2) for i, j in zip(coordinates, water_location)])
-        if squared_distance < squared_radius:
-            matchs.append(k)
-    return matchs
+    max_markers = args.markers
+
+    database = args.database
+    if database is not None and not os.path.exists(database):
+        print "Error: path to database \'", database, "\' not found."
+        parser.print_help()
+        exit(1)
+
+    shard_selection, partial_path = parseShardArguments(args, parser)
+
+    return reference, waters, trajectories, radius, x_data, y_data, output_path, report_name, reports, max_markers, database, shard_selection, partial_path
 
 
 def findWaterMatches(trajectories, waters, water_locations, radius, num_waters):
@@ -132,39 +135,14 @@ def findWaterMatches(trajectories, waters, water_locations, radius, num_waters):
 
     for num_entries, trajectory in enumerate(trajectories):
         traj_directory = os.path.dirname(trajectory)
-        traj_number = os.path.basename(trajectory).split('_')[-1].split('.')[0]
-
-        with open(trajectory, "r") as pdb_file:
-            results = {}
-            model = int(pdb_file.readline().split()[1])
-            results[model] = {}
-            for line in pdb_file:
-                if line.startswith("MODEL"):
-                    model += 1
-                    results[model] = {}
-                    continue
-                if not line.startswith('HETATM'):
-                    continue
-                fields = line.split()
-                if fields[3] != 'HOH' or fields[2] != 'OW':
-                    continue
+        traj_number = getTrajectoryNumber(trajectory)
 
-                coordinates = fields[6:9]
-                results[model][fields[4] + fields[5]] = waterInSphere(coordinates, water_locations, radius)
+        results = getModelWaterMatches(trajectory, water_locations, radius)
 
         matchs[traj_directory, traj_number] = []
 
-        for model, water_matchs in results.iteritems():
-            sorted_waters = sorted(water_matchs, key=lambda k: len(water_matchs[k]), reverse=True)
-
-            match_set = []
-            for water in sorted_waters:
-                for match in water_matchs[water]:
-                    if match not in match_set:
-                        match_set.append(match)
-                        break
-
-            matchs[traj_directory, traj_number].append(len(match_set))
+        for model, water_matchs in sorted(results.iteritems()):
+            matchs[traj_directory, traj_number].append(len(assignWaterSites(water_matchs)))
 
         if (num_entries + 1) / float(total_entries) * PROGRESS_BAR_WIDTH > current_position:
             current_position += 1
@@ -176,6 +154,45 @@ def findWaterMatches(trajectories, waters, water_locations, radius, num_waters):
     return matchs
 
 
+def loadReport(report):
+    with open(report, 'r') as report_file:
+        next(report_file)
+        rows = [[float(field) for field in line.split()] for line in report_file if line.strip()]
+
+    if len(rows) == 0:
+        return np.empty((0, 0))
+
+    columns = max(len(row) for row in rows)
+    return np.array([row + [np.nan] * (columns - len(row)) for row in rows])
+
+
+def saveMatchesPartial(partial_path, matchs, shard_trajectories, total_trajectories, trajectories_hash, reference, waters, radius, report_name):
+    matches_list = []
+    reports_list = []
+
+    for index, trajectory in shard_trajectories:
+        traj_directory = os.path.dirname(trajectory)
+        traj_number = getTrajectoryNumber(trajectory)
+        matches_list.append(matchs[traj_directory, traj_number])
+        reports_list.append(loadReport(traj_directory + "/" + report_name + "_" + traj_number))
+
+    # Reports are padded with NaN to a common number of columns
+    columns = max([report.shape[1] for report in reports_list] + [0])
+    reports_list = [np.pad(report, ((0, 0), (0, columns - report.shape[1])), 'constant', constant_values=np.nan)
+                    for report in reports_list]
+
+    matches, match_offsets = concatenateSegments(matches_list, dtype=np.int64)
+    reports, report_offsets = concatenateSegments(reports_list, shape=(columns, ))
+
+    settings = {"reference": reference,
+                "waters": [chain + ":" + residue_id for chain, residue_id in waters],
+                "radius": radius}
+
+    return savePartial(partial_path, MATCHES_PARTIAL, settings, shard_trajectories, total_trajectories, trajectories_hash,
+                       matches=matches, match_offsets=match_offsets,
+                       reports=reports, report_offsets=report_offsets)
+
+
 def parseAxisData(axis_data):
     if axis_data is None:
         return ([None, ] , None)
@@ -214,58 +231,66 @@ def parseAxisData(axis_data):
         return ([None, ], None)
 
 
-def scatterPlot(matchs, x_rows=[None, ], y_rows=[None, ], x_name=None, y_name=None, output_path=None, report_name = None):
+def getPlotData(matchs, x_rows, y_rows, report_name, reports=None):
     x_values = []
     y_values = []
     labels = []
-    annotations = []
-
-    if None in x_rows:
-        x_rows = [7, ]
-        x_name = "RMSD ($\AA$)"
-    if None in y_rows:
-        y_rows = [5, ]
-        y_name = "Energy ($kcal/mol$)"
-    if x_name is None:
-        x_name = '?'
-    if y_name is None:
-        y_name = '?'
+    point_trajectories = []
+    point_models = []
+    trajectories_info = []
 
     for traj_info, categories in matchs.iteritems():
         traj_directory, traj_number = traj_info
-        labels_size = len(labels)
 
-        report = traj_directory + "/" + report_name + "_" + traj_number
+        # Use the pairing of the input trajectories when available, so that no
+        # directory is listed again
+        report = os.path.join(traj_directory, report_name + "_" + traj_number)
+        epoch = None
+        if reports is not None and (os.path.abspath(traj_directory), traj_number) in reports:
+            pair = reports[os.path.abspath(traj_directory), traj_number]
+            report, epoch = pair["report"] or report, pair["epoch"]
+        if epoch is None:
+            epoch = getEpoch(traj_directory)
 
-        index = 0
+        try:
+            report_file = open(report, 'r')
+        except IOError:
+            print "Warning: report \'", report, "\' not found."
+            continue
 
-        with open(report, 'r') as report_file:
+        trajectory_index = len(trajectories_info)
+        trajectories_info.append((epoch, traj_number))
+
+        with report_file:
             next(report_file)
             for i, line in enumerate(report_file):
+                fields = line.split()
                 x_total = 0.
                 y_total = 0.
 
                 for x_row in x_rows:
-                    x_total += float(line.split()[x_row - 1])
+                    x_total += float(fields[x_row - 1])
 
                 for y_row in y_rows:
-                    y_total += float(line.split()[y_row - 1])
+                    y_total += float(fields[y_row - 1])
 
                 if isnan(x_total) or isnan(y_total):
                     continue
 
                 x_values.append(x_total)
                 y_values.append(y_total)
+                labels.append(categories[i])
+                point_trajectories.append(trajectory_index)
+                point_models.append(i + 1)
 
-                epoch = traj_directory.split('/')[-1]
-                if not epoch.isdigit():
-                    epoch = '0'
-
-                annotations.append("Epoch: " + epoch + "\n" + "Trajectory: " + traj_number + "\n" + "Model: " + str(i + 1))
+    return (np.array(x_values, dtype=np.float64), np.array(y_values, dtype=np.float64),
+            np.array(labels, dtype=np.int64), np.array(point_trajectories, dtype=np.int64),
+            np.array(point_models, dtype=np.int64), trajectories_info)
 
-                labels.append(categories[i])
 
-    norm = pyplot.Normalize(0, max(labels))
+def drawScatterPlot(x_values, y_values, labels, annotate, x_name, y_name, output_path=None, max_markers=MAX_MARKERS):
+    max_label = int(labels.max()) if len(labels) > 0 else 0
+    norm = pyplot.Normalize(0, max_label)
     cmap = pyplot.cm.RdYlGn
 
     fig, ax = pyplot.subplots()
@@ -275,10 +300,9 @@ def scatterPlot(matchs, x_rows=[None, ], y_rows=[None, ], x_name=None, y_name=No
     else:
         s = None
 
-    sc = pyplot.scatter(x_values, y_values, c=labels, cmap=cmap, s=s, norm=norm, alpha=0.6)
-
-    ax.margins(0.05)
     ax.set_facecolor('gray')
+    sc = DensityScatter(ax, x_values, y_values, labels, cmap, norm, s=s, alpha=0.6, max_markers=max_markers)
+
     pyplot.ylabel(y_name)
     pyplot.xlabel(x_name)
 
@@ -288,7 +312,7 @@ def scatterPlot(matchs, x_rows=[None, ], y_rows=[None, ], x_name=None, y_name=No
     annot.set_visible(False)
 
     patches_list = [patches.Patch(color=cmap(norm(0)), label='No matches', alpha=0.6), ]
-    for i in xrange(max(labels)):
+    for i in xrange(max_label):
         if i == 0:
             match_str = "match"
         else:
@@ -298,16 +322,15 @@ def scatterPlot(matchs, x_rows=[None, ], y_rows=[None, ], x_name=None, y_name=No
     ax.legend(handles=patches_list)
 
     def update_annot(ind):
-        pos = sc.get_offsets()[ind["ind"][0]]
-        annot.xy = pos
-        annot.set_text(annotations[int(ind["ind"][0])])
-        annot.get_bbox_patch().set_facecolor(cmap(norm(labels[ind["ind"][0]])))
+        annot.xy = (x_values[ind], y_values[ind])
+        annot.set_text(annotate(ind))
+        annot.get_bbox_patch().set_facecolor(cmap(norm(labels[ind])))
 
     def hover(event):
         vis = annot.get_visible()
         if event.inaxes == ax:
-            cont, ind = sc.contains(event)
-            if cont:
+            ind = sc.pointAt(event)
+            if ind is not None:
                 update_annot(ind)
                 annot.set_visible(True)
                 fig.canvas.draw_idle()
@@ -324,8 +347,69 @@ def scatterPlot(matchs, x_rows=[None, ], y_rows=[None, ], x_name=None, y_name=No
         pyplot.show()
 
 
+def getAxisDefaults(x_rows, y_rows, x_name, y_name):
+    if None in x_rows:
+        x_rows = [7, ]
+        x_name = "RMSD ($\AA$)"
+    if None in y_rows:
+        y_rows = [5, ]
+        y_name = "Energy ($kcal/mol$)"
+    if x_name is None:
+        x_name = '?'
+    if y_name is None:
+        y_name = '?'
+
+    return x_rows, y_rows, x_name, y_name
+
+
+def scatterPlot(matchs, x_rows=[None, ], y_rows=[None, ], x_name=None, y_name=None, output_path=None, report_name = None, max_markers=MAX_MARKERS, reports=None):
+    x_rows, y_rows, x_name, y_name = getAxisDefaults(x_rows, y_rows, x_name, y_name)
+
+    x_values, y_values, labels, point_trajectories, point_models, trajectories_info = getPlotData(matchs, x_rows, y_rows, report_name, reports)
+
+    # Annotations are only built for the hovered point
+    def annotate(ind):
+        epoch, traj_number = trajectories_info[point_trajectories[ind]]
+        return "Epoch: " + epoch + "\n" + "Trajectory: " + traj_number + "\n" + "Model: " + str(point_models[ind])
+
+    drawScatterPlot(x_values, y_values, labels, annotate, x_name, y_name, output_path=output_path, max_markers=max_markers)
+
+
+def scatterPlotFromDatabase(database, trajectories, x_rows=[None, ], y_rows=[None, ], x_name=None, y_name=None, output_path=None, max_markers=MAX_MARKERS):
+    x_rows, y_rows, x_name, y_name = getAxisDefaults(x_rows, y_rows, x_name, y_name)
+
+    connection = connectDatabase(database)
+    rows = getDatabasePlotData(connection, trajectories, x_rows, y_rows)
+    connection.close()
+
+    # Rows hold epoch, trajectory, model, sites_filled, x and y
+    x_values = np.array([row[4] for row in rows], dtype=np.float64)
+    y_values = np.array([row[5] for row in rows], dtype=np.float64)
+    labels = np.array([row[3] for row in rows], dtype=np.int64)
+    point_info = [(row[0], row[1], row[2]) for row in rows]
+
+    def annotate(ind):
+        epoch, traj_number, model = point_info[ind]
+        return "Epoch: " + str(epoch) + "\n" + "Trajectory: " + str(traj_number) + "\n" + "Model: " + str(model)
+
+    drawScatterPlot(x_values, y_values, labels, annotate, x_name, y_name, output_path=output_path, max_markers=max_markers)
+
+
 def main():
-    reference, waters, trajectories, radius, x_data, y_data, output_path, report = parseArgs()
+    reference, waters, trajectories, radius, x_data, y_data, output_path, report, reports, max_markers, database, shard_selection, partial_path = parseArgs()
+
+    if database is not None:
+        x_rows, x_name = parseAxisData(x_data)
+        y_rows, y_name = parseAxisData(y_data)
+
+        print " - Plotting from database..."
+        scatterPlotFromDatabase(database, trajectories, x_rows=x_rows, y_rows=y_rows, x_name=x_name, y_name=y_name, output_path=output_path, max_markers=max_markers)
+        return
+
+    if isSharded(shard_selection) or partial_path is not None:
+        shard_trajectories, total_trajectories, trajectories_hash = selectShard(trajectories, shard_selection)
+        trajectories = [trajectory for index, trajectory in shard_trajectories]
+        print "{} of {} trajectories belong to this shard".format(len(trajectories), total_trajectories)
 
     num_waters = len(waters)
     print "{} water positions are going to be analyzed".format(num_waters)
@@ -336,11 +420,18 @@ def main():
     print " - Finding matches..."
     matchs = findWaterMatches(trajectories, waters, water_locations, radius, num_waters)
 
+    if partial_path is not None:
+        print " - Saving partial results..."
+        partial_path = saveMatchesPartial(partial_path, matchs, shard_trajectories, total_trajectories, trajectories_hash,
+                                          reference, waters, radius, report)
+        print "Partial results saved at:", partial_path
+        return
+
     x_rows, x_name = parseAxisData(x_data)
     y_rows, y_name = parseAxisData(y_data)
 
     print " - Plotting..."
-    scatterPlot(matchs, x_rows=x_rows, y_rows=y_rows, x_name=x_name, y_name=y_name, output_path=output_path, report_name=report)
+    scatterPlot(matchs, x_rows=x_rows, y_rows=y_rows, x_name=x_name, y_name=y_name, output_path=output_path, report_name=report, max_markers=max_markers, reports=reports)
 
 
 if __name__ == "__main__":
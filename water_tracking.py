@@ -4,9 +4,13 @@ from __future__ import unicode_literals
 import argparse as ap
 import os
 import glob
+import numpy as np
 from matplotlib import pyplot
 from mpl_toolkits.mplot3d import Axes3D
 from subprocess import call
+from coordinates_file import saveBinaryCoordinates, saveTextCoordinates, BINARY_EXTENSION, TEXT_EXTENSION
+from pele_manifest import findTrajectories
+from shard_analysis import addShardArguments, parseShardArguments, isSharded, selectShard, concatenateSegments, savePartial, TRACKING_PARTIAL
 
 FILENAME = "WaterTracking"
 CHIMERA_PATH = "/home/municoy/.local/UCSF-Chimera64-1.12/bin/chimera"
@@ -16,11 +20,13 @@ def parseTrajectories(trajectories_to_parse):
     trajectories = []
 
     for trajectory_list in trajectories_to_parse:
-        trajectories_found = glob.glob(trajectory_list)
+        if os.path.isdir(trajectory_list):
+            trajectories_found = [pair["trajectory"] for pair in findTrajectories(trajectory_list)]
+        else:
+            trajectories_found = glob.glob(trajectory_list)
         if len(trajectories_found) == 0:
             print "Warning: trajectory path \'", trajectory_list, "\' not found."
-        for trajectory in glob.glob(trajectory_list):
-            trajectories.append(trajectory)
+        trajectories += trajectories_found
 
     if len(trajectories) == 0:
         print "Error: list of trajectories is empty."
@@ -53,9 +59,12 @@ def parseArgs():
     parser = ap.ArgumentParser()
     optional = parser._action_groups.pop()
     required = parser.add_argument_group('required arguments')
-    required.add_argument("-i", "--input", required=True, metavar="PATH", type=str, nargs='*', help="path to trajectory files")
+    required.add_argument("-i", "--input", required=True, metavar="PATH", type=str, nargs='*', help="path to trajectory files or PELE output directories")
     required.add_argument("-w", "--waters", required=True, metavar="CHAIN:ID", type=str, nargs='*', help="list of water ids")
     required.add_argument("-r", "--ref", required=True, metavar="PATH", type=str, help="path to reference structure")
+    optional.add_argument("-f", "--format", metavar="FORMAT", type=str, choices=["binary", "text"], help="format of the coordinates file (binary or text)", default="binary")
+    optional.add_argument("-z", "--compress", action="store_true", help="compress binary coordinates file (disables memory-mapping)")
+    addShardArguments(optional)
     parser._action_groups.append(optional)
     args = parser.parse_args()
 
@@ -67,16 +76,17 @@ def parseArgs():
     trajectories = parseTrajectories(args.input)
     waters = parseResidues(args.waters)
 
-    return reference, trajectories, waters
+    shard_selection, partial_path = parseShardArguments(args, parser)
 
+    return reference, trajectories, waters, args.format, args.compress, shard_selection, partial_path
 
-def trackWaters(trajectories, waters):
+
+def trackWaters(trajectories, waters, first=True):
     results = {}
     
     for water in waters:
         results[water[0] + water[1]] = []
 
-    first = True
     for trajectory in trajectories:
         with open(trajectory, 'r') as trajectory_file:
             # Only add waters from MODEL 1 once
@@ -97,6 +107,26 @@ def trackWaters(trajectories, waters):
     return results
 
 
+def saveTrackingPartial(partial_path, shard_trajectories, total_trajectories, trajectories_hash, reference, waters):
+    water_names = [water[0] + water[1] for water in waters]
+    segments = []
+
+    # Each trajectory is tracked on its own so that partials can be merged in
+    # the global trajectory order, with MODEL 1 kept only for the first one
+    for index, trajectory in shard_trajectories:
+        tracking = trackWaters([trajectory, ], waters, first=(index == 0))
+        for water in water_names:
+            segments.append(tracking[water])
+
+    coordinates, offsets = concatenateSegments(segments, shape=(3, ), dtype=np.float32)
+
+    settings = {"reference": reference,
+                "waters": water_names}
+
+    return savePartial(partial_path, TRACKING_PARTIAL, settings, shard_trajectories, total_trajectories, trajectories_hash,
+                       coordinates=coordinates, offsets=offsets)
+
+
 def plotWaterTracking(data):
     fig = pyplot.figure()
     ax = fig.add_subplot(111, projection='3d')
@@ -111,14 +141,20 @@ def plotWaterTracking(data):
     pyplot.show()
 
 
-def saveTrackingToPDB(data, reference):
-    filename_path = os.path.abspath(FILENAME + ".pdb")
+def getAvailablePath(extension):
+    filename_path = os.path.abspath(FILENAME + extension)
     filename_dir = os.path.dirname(filename_path)
     filename_id = 0
 
     while os.path.exists(filename_path):
         filename_id += 1
-        filename_path = filename_dir + '/' + FILENAME + "_" + str(filename_id) + ".pdb"
+        filename_path = filename_dir + '/' + FILENAME + "_" + str(filename_id) + extension
+
+    return filename_path
+
+
+def saveTrackingToPDB(data, reference):
+    filename_path = getAvailablePath(".pdb")
 
     with open(filename_path, 'w') as pdb_file:
         with open(reference, 'r') as ref_file:
@@ -154,31 +190,35 @@ def saveTrackingToPDB(data, reference):
     return filename_path
 
 
-def saveCoordinatesFile(data, reference):
-    filename_path = os.path.abspath(FILENAME + ".out")
-    filename_dir = os.path.dirname(filename_path)
-    filename_id = 0
+def saveCoordinatesFile(data, reference, file_format="binary", compress=False):
+    if file_format == "text":
+        return saveTextCoordinates(getAvailablePath(TEXT_EXTENSION), data, reference)
 
-    while os.path.exists(filename_path):
-        filename_id += 1
-        filename_path = filename_dir + '/' + FILENAME + "_" + str(filename_id) + ".out"
+    compression = "zlib" if compress else "none"
+    return saveBinaryCoordinates(getAvailablePath(BINARY_EXTENSION), data, reference, compression=compression)
 
-    with open(filename_path, 'w') as pdb_file:
-        pdb_file.write(reference + '\n')
-        for water, coordinates in data.iteritems():
-            for point in coordinates:
-                pdb_file.write("{} {: 7.3f} {: 7.3f} {: 7.3f}\n".format(water, float(point[0]), float(point[1]), float(point[2])))
-
-    return filename_path
 
 def main():
-    reference, trajectories, waters = parseArgs()
+    reference, trajectories, waters, file_format, compress, shard_selection, partial_path = parseArgs()
+
+    first = True
+    if isSharded(shard_selection) or partial_path is not None:
+        shard_trajectories, total_trajectories, trajectories_hash = selectShard(trajectories, shard_selection)
+        trajectories = [trajectory for index, trajectory in shard_trajectories]
+        first = len(shard_trajectories) > 0 and shard_trajectories[0][0] == 0
+        print "{} of {} trajectories belong to this shard".format(len(trajectories), total_trajectories)
+
     print "Tracking waters..."
-    water_tracking = trackWaters(trajectories, waters)
+    if partial_path is not None:
+        partial_path = saveTrackingPartial(partial_path, shard_trajectories, total_trajectories, trajectories_hash, reference, waters)
+        print "Partial results saved at:", partial_path
+        return
+
+    water_tracking = trackWaters(trajectories, waters, first)
     #plotWaterTracking(water_tracking)
     #filename_path = saveTrackingToPDB(water_tracking, reference)
     print "Saving coordinates..."
-    filename_path = saveCoordinatesFile(water_tracking, reference)
+    filename_path = saveCoordinatesFile(water_tracking, reference, file_format, compress)
     print "Coordinates saved at:", filename_path
 
 